@@ -2,7 +2,7 @@ from .core import *
 from .imgui import *
 
 from .entity.camera import Camera
-from .entity.lighting import DirectionalLight, PointLight, Light
+from .entity.lighting import DirectionalLight, PointLight, Light, LightClusters
 from .entity.renderable import Model, Skybox
 
 from .window import Window
\ No newline at end of file
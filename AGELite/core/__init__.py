@@ -1,5 +1,7 @@
-from .program import Program, UniformContext
-from .texture import  Texture, TEXTURE
+from .program import Program, UniformContext, VertexArray
+from .watcher import ShaderWatcher
+from .uniform_block import UniformBlock, UNIFORM_BLOCK
+from .texture import  Texture, TEXTURE, TextureRegistry, MaterialArray
 from .geometry import primitive_cube, primitive_quad, \
 primitive_square, primitive_triangle, new_cube, triangulate, bake_tangants, \
-new_triangle_screen, new_sphere
\ No newline at end of file
+new_triangle_screen, new_sphere, new_arrow, load_mdl, stream_mdl, upload_mdl, weld, pack_compact
\ No newline at end of file
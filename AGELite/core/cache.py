@@ -0,0 +1,82 @@
+from pathlib import Path
+from typing import Callable, BinaryIO
+import hashlib
+import json
+import os
+import threading
+
+
+class CACHE:
+    """ On-disk cache globals """
+    FOLDER = Path(".cache")
+    MESH_FOLDER = FOLDER.joinpath("mdl")
+    TEXTURE_FOLDER = FOLDER.joinpath("textures")
+
+    TEXTURE_MAX_BYTES = 1 << 30 # least recently used textures are evicted above this size
+
+    HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path: Path) -> str:
+    """ sha1 of a file content, read by chunks """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        while chunk := file.read(CACHE.HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def key_hash(*parts) -> str:
+    """ short stable hash of a cache key """
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+def read_meta(path: Path) -> dict | None:
+    """ read a cache entry metadata file, None if missing or corrupted """
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+def write_atomic(path: Path, write: Callable[[BinaryIO], None]) -> None:
+    """ write a cache file through a temporary file so a partially written entry is never visible """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp") # entries can be written from worker threads
+    try:
+        with open(tmp_path, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+def write_meta(path: Path, meta: dict) -> None:
+    """ write a cache entry metadata file """
+    write_atomic(path, lambda file: file.write(json.dumps(meta, indent=1).encode()))
+
+def touch(path: Path) -> None:
+    """ mark a cache entry as recently used (for evict_lru) """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def evict_lru(folder: Path, max_bytes: int, pattern: str="*") -> int:
+    """ delete the least recently used (oldest mtime) entries of a folder until it fits in max_bytes, returns the number of bytes freed """
+    entries = []
+    for path in folder.glob(pattern):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total - freed <= max_bytes:
+            break
+        try:
+            path.unlink()
+            freed += size
+        except OSError:
+            pass
+    return freed
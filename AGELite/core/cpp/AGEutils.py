@@ -1,8 +1,15 @@
 import ctypes
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Callable
 
+import numpy as np
+
 bake_tangants: Callable = None
+BakeProgress = Callable[[int, int], None] # progress(baked_faces, total_faces)
+BAKE_TANGANTS_VERSION = 1 # bump when the baked output changes (invalidates the mesh cache)
 
 class _globals:
     """ hold globals for AGEutils.dll wrapper """
@@ -15,49 +22,157 @@ class _globals:
     size_of_faces_in = size_of_float * nb_floats_per_vertex_in * nb_vertex_per_face
     size_of_faces_out = size_of_float * nb_flooats_per_vertex_out * nb_vertex_per_face
 
-    dll_path = Path("AGELite/core/cpp/AGEutils.dll").resolve()
+    # native libraries exporting: void bake_tangants(const char* in, char* out, size_t in_nb_faces)
+    # AGEUTILS_LIBRARY can point to a custom build, else the library next to this file is used
+    # note: the shared object must not be named AGEutils.so, python would import it instead of this module
+    library_folder = Path(__file__).parent.resolve()
+    library_name = "AGEutils.dll" if sys.platform == "win32" else "libAGEutils.so"
+
+    dll_path: Path = None
+    hllDll = None
+    backend = "numpy"
+
+    # parallel baking (bake_tangants(..., workers=n)): meshes below this number of faces are always baked serially
+    parallel_min_faces = 65536
+
+
+def _load_native_library() -> None:
+    """ look for a native bake_tangants library (AGEutils.dll on Windows, libAGEutils.so elsewhere) """
+    if "AGEUTILS_LIBRARY" in os.environ:
+        candidates = [Path(os.environ["AGEUTILS_LIBRARY"]).resolve()]
+    else:
+        candidates = [_globals.library_folder.joinpath(_globals.library_name)]
+
+    for path in candidates:
+        if not path.exists():
+            continue
+        try:
+            if sys.platform == "win32":
+                hllDll = ctypes.WinDLL(path.__str__())
+            else:
+                hllDll = ctypes.CDLL(path.__str__())
+            hllDll.bake_tangants.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+            hllDll.bake_tangants.restype = None
+        except Exception as e:
+            # IMPORTANT: if the DLL did not load sucessfully, it might be because you don't have msvc143 installed in your computer.
+            print(f"\x1b[33m{path.name} can't be initialized:\n{e}\x1b[0m")
+            continue
+
+        _globals.dll_path = path
+        _globals.hllDll = hllDll
+        _globals.backend = path.name
+        return
+
+    print(f"\x1b[33m{' / '.join(p.name for p in candidates)} not found\x1b[0m")
+
+
+def _as_faces(buffer: bytes | np.ndarray) -> np.ndarray:
+    """ zero-copy (N, 3, 8) float32 view of an input buffer (bytes, bytearray, memoryview or np.ndarray) """
+    faces = buffer if isinstance(buffer, np.ndarray) else np.frombuffer(buffer, dtype='f4')
+    faces = np.ascontiguousarray(faces, dtype='f4') # no copy if already contiguous float32
+
+    assert faces.nbytes % _globals.size_of_faces_in == 0 # buffer should be multiple of faces
+
+    return faces.reshape(-1, _globals.nb_vertex_per_face, _globals.nb_floats_per_vertex_in)
+
+
+def _as_output(nb_faces: int, out: np.ndarray | None) -> np.ndarray:
+    """ (nb_faces*3, 14) float32 output, allocated if out is None """
+    shape = (nb_faces * _globals.nb_vertex_per_face, _globals.nb_flooats_per_vertex_out)
+    if out is None:
+        return np.empty(shape, dtype='f4')
+
+    assert out.shape == shape and out.dtype == np.float32 and out.flags.c_contiguous, f"bake_tangants: out must be a contiguous float32 array of shape {shape}"
+    return out
+
+
+def _bake_sharded(bake_faces: Callable[[np.ndarray, np.ndarray], None], buffer: bytes | np.ndarray, workers: int | None=1, progress: BakeProgress | None=None, out: np.ndarray | None=None) -> np.ndarray:
+    """ bake a buffer with a kernel, splitting it on face boundaries across a thread pool if workers > 1 (None: one per core) """
+    faces = _as_faces(buffer)
+    nb_faces = faces.shape[0]
+
+    # every shard writes directly into its own range of the shared output
+    out = _as_output(nb_faces, out)
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or nb_faces < _globals.parallel_min_faces:
+        bake_faces(faces, out)
+        if progress is not None:
+            progress(nb_faces, nb_faces)
+        return out
+
+    # the native library and numpy both release the GIL while baking
+    bounds = np.linspace(0, nb_faces, workers + 1, dtype=int)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bake_tangants") as pool:
+        shards = {pool.submit(bake_faces, faces[start:end], out[start * _globals.nb_vertex_per_face:end * _globals.nb_vertex_per_face]): end - start for start, end in zip(bounds[:-1], bounds[1:])}
+        baked = 0
+        for shard in as_completed(shards):
+            shard.result() # propagate exceptions
+            baked += shards[shard]
+            if progress is not None:
+                progress(baked, nb_faces)
+
+    return out
+
+
+def _dll_bake_faces(faces: np.ndarray, out: np.ndarray) -> None:
+    """ AGEutils.dll/.so kernel: bake (N, 3, 8) faces into a preallocated (N*3, 14) output """
+    # void bake_tangants(const char* in, char* out, size_t in_nb_faces)
+    # numpy buffers are handed to the library as-is, no intermediate copies
+    _globals.hllDll.bake_tangants(faces.ctypes.data, out.ctypes.data, faces.shape[0])
 
-    try:
-        if dll_path.exists():
-            hllDll = ctypes.WinDLL(dll_path.__str__())
-        else:
-            print("\x1b[33mAGEutils.dll not found\x1b[0m")
-            hllDll = None
-    except Exception as e:
-        # IMPORTANT: if the DLL did not load sucessfully, it might be because you don't have msvc143 installed in your computer. 
-        hllDll = None
-        print(f"\x1b[33mAGEutils.dll can't be initialized:\n{e}\x1b[0m")
+def _np_bake_faces(faces: np.ndarray, out: np.ndarray) -> None:
+    """ numpy kernel: bake (N, 3, 8) faces into a preallocated (N*3, 14) output """
+    uv       = faces[:, :, 0:2]
+    normal   = faces[:, :, 2:5]
+    position = faces[:, :, 5:8]
 
+    # compute tangent/bitangent for all faces at once
+    edge1 = position[:, 1] - position[:, 0]
+    edge2 = position[:, 2] - position[:, 0]
 
-def _dll_bake_tangants(buffer: bytes) -> bytes:
-    """ AGEutils.dll wrapper for bake_tangants """
+    deltaUV1 = uv[:, 1] - uv[:, 0]
+    deltaUV2 = uv[:, 2] - uv[:, 0]
 
-    assert type(buffer) == bytes
-    assert _globals.hllDll.bake_tangants
+    with np.errstate(divide='ignore', invalid='ignore'): # degenerated uvs gives inf/nan as the dll does
+        f = 1.0 / (deltaUV1[:, 0] * deltaUV2[:, 1] - deltaUV2[:, 0] * deltaUV1[:, 1])
 
-    _size_of_buffer_in = len(buffer)
+        tangent   = f[:, None] * ( deltaUV2[:, 1:2] * edge1 - deltaUV1[:, 1:2] * edge2)
+        bitangent = f[:, None] * (-deltaUV2[:, 0:1] * edge1 + deltaUV1[:, 0:1] * edge2)
 
-    assert _size_of_buffer_in % _globals.size_of_faces_in == 0 # buffer should be multiple of faces
+        # normalized like AGEutils.dll
+        tangent   /= np.sqrt(np.einsum('ij,ij->i', tangent, tangent))[:, None]
+        bitangent /= np.sqrt(np.einsum('ij,ij->i', bitangent, bitangent))[:, None]
 
-    _nb_faces = _size_of_buffer_in // _globals.size_of_faces_in
-    _size_of_buffer_out = _globals.size_of_faces_out * _nb_faces
+    # output: (uv, bitangent, tangent, normal, position) * 3 vertices per face
+    out = out.reshape(faces.shape[0], _globals.nb_vertex_per_face, _globals.nb_flooats_per_vertex_out)
+    out[:, :, 0:2]   = uv
+    out[:, :, 2:5]   = bitangent[:, None, :]
+    out[:, :, 5:8]   = tangent[:, None, :]
+    out[:, :, 8:11]  = normal
+    out[:, :, 11:14] = position
 
-    data = ctypes.create_string_buffer(buffer, _size_of_buffer_in)
-    out = (ctypes.c_char_p * _size_of_buffer_out)()
 
-    # void bake_tangants(const char* in, char* out, size_t in_nb_faces)
-    _globals.hllDll.bake_tangants(ctypes.byref(data), ctypes.byref(out), _nb_faces)
+def _dll_bake_tangants(buffer: bytes | np.ndarray, workers: int | None=1, progress: BakeProgress | None=None, out: np.ndarray | None=None) -> np.ndarray:
+    """ AGEutils.dll/.so wrapper for bake_tangants """
+    assert _globals.hllDll.bake_tangants
+    return _bake_sharded(_dll_bake_faces, buffer, workers, progress, out)
 
-    return bytes(out)
+def _np_bake_tangants(buffer: bytes | np.ndarray, workers: int | None=1, progress: BakeProgress | None=None, out: np.ndarray | None=None) -> np.ndarray:
+    """ vectorized numpy implementation of bake_tangants used if no native library can be loaded """
+    return _bake_sharded(_np_bake_faces, buffer, workers, progress, out)
 
-def _py_bake_tangants(buffer: bytes) -> bytes:
-    """ legacy python implementation of bake_tangants if the dll can't be loaded """
+def _py_bake_tangants(buffer: bytes | np.ndarray, workers: int | None=1, progress: BakeProgress | None=None, out: np.ndarray | None=None) -> np.ndarray:
+    """ legacy python implementation of bake_tangants (slow, kept as reference for _np_bake_tangants). Always serial. """
     from io import BytesIO
     from struct import unpack, pack
     import glm
 
+    buffer = _as_faces(buffer).tobytes()
+
     # output buffer
-    out = BytesIO() 
+    output = None if out is None else _as_output(len(buffer) // _globals.size_of_faces_in, out)
+    out = BytesIO()
 
     # constants representing the size of all elements
 
@@ -82,7 +197,7 @@ def _py_bake_tangants(buffer: bytes) -> bytes:
         face.clear()
 
         # get each vertex data of the face
-        for j in range(0, sF, sV): 
+        for j in range(0, sF, sV):
             u, v, nx, ny, nz, x, y, z  = unpack('2f 3f 3f', buffer[i+j:i+j+sV])
             face.append((glm.vec3(x, y, z), glm.vec3(nx, ny, nz), glm.vec2(u, v)))
 
@@ -104,19 +219,57 @@ def _py_bake_tangants(buffer: bytes) -> bytes:
         for v in face:
             out.write(pack('2f 3f 3f 3f 3f', *v[2].to_tuple(), *bitangent.to_tuple(), *tangent.to_tuple(), *v[1].to_tuple(), *v[0].to_tuple()))
 
-        # print progress
-        if i//sF % (nb_faces//5) == 0: # every 20%
-            p = i//sF
-            print(f"   {p}/{nb_faces} ({ (p/(nb_faces)*100):.2f}%)                          ", end='\r')
-    print("                                                                                 ", end='\r')
-    
+        # report progress every 20%
+        if progress is not None and i//sF % max(1, nb_faces//5) == 0:
+            progress(i//sF, nb_faces)
+
+    if progress is not None:
+        progress(nb_faces, nb_faces)
+
     # return the result
-    out.seek(0)
-    return out.read()
+    result = np.frombuffer(out.getbuffer(), dtype='f4').reshape(-1, _globals.nb_flooats_per_vertex_out)
+    if output is None:
+        return result
+    output[:] = result
+    return output
+
 
+_load_native_library()
 
 if _globals.hllDll is not None:
     bake_tangants = _dll_bake_tangants
 else:
-    bake_tangants = _py_bake_tangants
-    print("\x1b[33mWARNING: AGEutils.dll not initialized, using Python implementation. Will be slower.\x1b[0m")
+    bake_tangants = _np_bake_tangants
+    print("\x1b[33mWARNING: no native AGEutils library initialized, using numpy implementation.\x1b[0m")
+
+print(f"AGEutils: bake_tangants backend is '{_globals.backend}'")
+
+
+if __name__ == "__main__":
+    # parity test between the available backends (run from the project root: python AGELite/core/cpp/AGEutils.py)
+    _globals.parallel_min_faces = 0 # also exercise sharding on the small test meshes
+    rng = np.random.default_rng(0)
+    meshes = {"random": rng.uniform(-1.0, 1.0, (2048, _globals.nb_vertex_per_face, _globals.nb_floats_per_vertex_in)).astype('f4')}
+
+    arrow_path = Path("res/mdl/arrow.mdl")
+    if arrow_path.exists():
+        meshes["arrow"] = arrow_path.read_bytes()
+
+    for name, mesh in meshes.items():
+        reference = _py_bake_tangants(mesh).copy()
+        for columns in (slice(2, 5), slice(5, 8)): # legacy implementation does not normalize tangent/bitangent
+            reference[:, columns] /= np.linalg.norm(reference[:, columns], axis=1, keepdims=True)
+
+        backends = {"numpy": _np_bake_tangants}
+        if _globals.hllDll is not None:
+            backends[_globals.backend] = _dll_bake_tangants
+
+        for backend, func in backends.items():
+            reported = []
+            result = func(mesh, progress=lambda baked, total: reported.append((baked, total)))
+            assert reported and reported[-1][0] == reported[-1][1] == result.shape[0] // _globals.nb_vertex_per_face
+            assert np.array_equal(result, func(mesh, workers=3), equal_nan=True) # sharding must not change the output
+            assert np.array_equal(result, func(mesh, out=np.empty_like(result)), equal_nan=True)
+            assert result.shape == reference.shape, f"{backend}: {result.shape} != {reference.shape}"
+            assert np.allclose(result, reference, atol=1e-4, equal_nan=True), f"{backend}: max error {np.nanmax(np.abs(result - reference))}"
+            print(f"{name:>8} | {backend:>14} | OK")
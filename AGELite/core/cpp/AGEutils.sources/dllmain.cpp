@@ -1,9 +1,14 @@
-#define WIN32_LEAN_AND_MEAN
-#include <windows.h>
+#include <string.h>
 
 #include "vec.h"
 #include "globals.h"
 
+#ifdef _WIN32
+#define WIN32_LEAN_AND_MEAN
+#include <windows.h>
+
+#define AGE_EXPORT extern "C" __declspec(dllexport)
+
 BOOL APIENTRY DllMain(HMODULE hModule, DWORD  ul_reason_for_call, LPVOID lpReserved) {
     switch (ul_reason_for_call) {
         case DLL_PROCESS_ATTACH:
@@ -14,6 +19,10 @@ BOOL APIENTRY DllMain(HMODULE hModule, DWORD  ul_reason_for_call, LPVOID lpReser
     }
     return TRUE;
 }
+#else
+// shared object build (AGEutils.so), same ABI as AGEutils.dll
+#define AGE_EXPORT extern "C" __attribute__((visibility("default")))
+#endif
 
 // Input vertex structure
 struct VertIn {
@@ -71,7 +80,7 @@ inline void tanbit_t_faceout(const vec3& tangant, const vec3& bitangant, FaceOut
     out->v2.bitangant = bitangant;
 }
 
-extern "C" __declspec(dllexport) void bake_tangants(const char* vertices_in, char* vertices_out, const size_t nb_faces_in) {
+AGE_EXPORT void bake_tangants(const char* vertices_in, char* vertices_out, const size_t nb_faces_in) {
     // bake tangant and bitangent to the vertices data
 
     // variables
@@ -1,4 +1,3 @@
-#include <stdfloat>
 #include <math.h>
 
 /*
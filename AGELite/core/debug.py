@@ -2,27 +2,48 @@ import re
 
 DEBUG = True
 
-def fmt_program_exception_on_build(vertex_shader: str, fragment_shader: str, exc:Exception, range:int=4) -> str:
-    """ Format mgl.program exception """
-    if not DEBUG: 
-        return exc
+LINE_BASE = 10000 # include number K is numbered from K * LINE_BASE by #line directives (see Program.preprocess), some drivers (ie. Mesa) don't report the source string number
 
-    for _type in re.findall(r"(.*)\n======*\n.*", str(exc)):
-        s_error = ""
-        
-        if _type == "vertex_shader":
-            lines = vertex_shader.splitlines()
+# "<source>(<line>) : <error>" (NVIDIA) or "<source>:<line>(<column>): <error>" (Mesa)
+_ERROR_PATTERN = re.compile(r"^(\d+)(?:\((\d+)\)\s|:(\d+)\(\d+\)):\s(.*)$", flags=re.MULTILINE)
+_STAGE_PATTERN = re.compile(r"^(\w+_shader)\n=+\n", flags=re.MULTILINE)
 
-        elif _type == "fragment_shader":
-            lines = fragment_shader.splitlines()
+def fmt_program_exception_on_build(vertex_shader: str, fragment_shader: str, exc:Exception, range:int=4, vertex_files: list[tuple[str, str]] | None=None, fragment_files: list[tuple[str, str]] | None=None) -> str:
+    """ Format mgl.program exception
+    *_files are the (name, text) of the source strings of a stage (see Program.preprocess), errors are then shown in their original file """
+    if not DEBUG:
+        return exc
 
-        for line, error in re.findall(r"0\((\d*)\)\s:\s(.*)", str(exc)):
-            line = int(line)-1 # error line marker starts at 1
+    stages = {"vertex_shader": (vertex_shader, vertex_files), "fragment_shader": (fragment_shader, fragment_files)}
+    sections = _STAGE_PATTERN.split(str(exc)) # [header, stage, log, stage, log, ...]
+
+    s_error = ""
+    for _type, log in zip(sections[1::2], sections[2::2]):
+        if _type not in stages:
+            continue
+        source, files = stages[_type]
+
+        for number, nvidia_line, mesa_line, error in _ERROR_PATTERN.findall(log):
+            number, line = int(number), int(nvidia_line or mesa_line)
+            name = _type
+            if files is None:
+                lines = source.splitlines()
+            else:
+                index = number or line // LINE_BASE
+                if index >= len(files):
+                    continue
+                name, text = files[index]
+                line -= index * LINE_BASE
+                lines = text.splitlines()
+
+            line = line-1 # error line marker starts at 1
+            if not 0 <= line < len(lines):
+                continue
 
             lines[line] = f"\033[91m{lines[line]}\033[0m" # colorize errored line
-            scope = "\n".join(lines[ max(0,line-range) : min(len(lines),line+range) ]) # get lines before and after to a certain range and join them 
-            s_error += f"{_type} @ {line+1}\n{scope}\n\n{error}\n==============\n" # format the error message
+            scope = "\n".join(lines[ max(0,line-range) : min(len(lines),line+range) ]) # get lines before and after to a certain range and join them
+            s_error += f"{name} @ {line+1}\n{scope}\n\n{error}\n==============\n" # format the error message
 
+    if not s_error: # ie. link errors
+        return exc
     return type(exc)(s_error)
-
-
@@ -17,8 +17,12 @@ class Deferable:
         m.something_defered()
         ...
         m.run_all() # or m.run(<queue name>)
+
+    A deferred function can return Deferable.PENDING to stay in its queue and be called again on the next run (ie. waiting for a background job).
         """
 
+    PENDING = object() # returned by a deferred function to be kept in its queue
+
 
     def __init__(self, queues: list[str|int]=None):
         if queues is None or len(queues) == 0:
@@ -42,8 +46,9 @@ class Deferable:
         if queue_name not in self._q or len(self._q[queue_name]) == 0:
             return
         
-        [func() for func in self._q[queue_name]]
-        self._q[queue_name].clear()
+        # functions deferred while running are kept for the next run, after the pending ones
+        queue, self._q[queue_name] = self._q[queue_name], []
+        self._q[queue_name][:0] = [func for func in queue if func() is Deferable.PENDING]
 
     def run_all(self):
         """ Execute all functions in all queues """
@@ -100,6 +105,23 @@ if __name__ == "__main__":
     t.q2()
     print("run all:"); t.run_all()
 
+    class Waiting(Deferable):
+        def __init__(self):
+            super().__init__(["wait"])
+            self.ready = False
+
+        @Deferable.defer("wait")
+        def wait(self):
+            if not self.ready: return Deferable.PENDING
+            print("ready")
+
+    w = Waiting()
+    w.wait()
+    print("run pending:"); w.run_all()  # expected none outputs
+    w.ready = True
+    print("run ready:"); w.run_all()    # expected output: ready
+    print("run again:"); w.run_all()    # expected none outputs
+
     """ expected output: 
     run all
     q2
@@ -110,4 +132,8 @@ if __name__ == "__main__":
     q1
     run all
     q2
+    run pending
+    run ready
+    ready
+    run again
     """
\ No newline at end of file
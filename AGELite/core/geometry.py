@@ -1,9 +1,17 @@
+from collections import deque
 from pathlib import Path
+from typing import Iterator, TYPE_CHECKING
+import hashlib
 
 import numpy as np 
 import glm
 
-from .cpp.AGEutils import bake_tangants
+from .cpp.AGEutils import bake_tangants, BakeProgress, BAKE_TANGANTS_VERSION
+from .cache import CACHE, file_hash, key_hash, read_meta, write_atomic, write_meta
+from ..imgui.logging import UI_Logger as Log
+
+if TYPE_CHECKING:
+    import moderngl as mgl
 
 def triangulate(vertices: list[tuple[int]], indices: list[tuple[int]]) -> list[tuple[int]]:
     """ triangulate a list of vertices and indices """
@@ -42,22 +50,250 @@ def primitive_cube(boundary_box: tuple[tuple[int]] = ((-1, -1, -1), (1, 1, 1)))
     indices = [(0, 2, 3), (0, 1, 2), (1, 7, 2), (1, 6, 7), (6, 5, 4), (4, 7, 6), (3, 4, 5), (3, 5, 0), (3, 7, 4), (3, 2, 7), (0, 6, 1), (0, 5, 6)]
     return triangulate(vertices, indices)
 
-def new_sphere() -> np.ndarray:
-    """ load the sphere model """
-    # format of data within the mdl file: (v2f uv,v3f normal,v3f position) * number of vertices
-    # calls bake_tangants() to add tangant and bitangent to the vertices
-    # output format: (v2f uv, v3f tangent, v3f bitangent,v3f normal,v3f position) * number of vertices
-    return np.fromstring(bake_tangants(Path("./res/mdl/sphere.mdl").read_bytes()), dtype='f4').reshape(-1, 14)
+def weld(vertices: np.ndarray, smooth_tangents: bool=False) -> tuple[np.ndarray, np.ndarray]:
+    """ merge identical vertices into a unique vertex array and an index array (uint16 if possible, else uint32) """
+    # smooth_tangents: vertices sharing uv, normal and position are merged and their per-face tangents/bitangents averaged
+    vertices = np.ascontiguousarray(vertices, dtype='f4').reshape(-1, 14)
+    key = vertices[:, _WELD_KEY_COLUMNS] if smooth_tangents else vertices
+    key = np.ascontiguousarray(key + np.float32(0.0)) # -0.0 -> 0.0 so both hash the same
+
+    # hash each vertex as a single opaque row of bytes
+    rows = key.view(np.dtype((np.void, key.dtype.itemsize * key.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+    # keep vertices in first-use order
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(order.shape[0])
+    indices = remap[inverse.ravel()]
+    unique = vertices[first[order]]
+
+    if smooth_tangents:
+        for columns in (slice(2, 5), slice(5, 8)): # bitangent, tangent
+            frames = np.where(np.isfinite(vertices[:, columns]), vertices[:, columns], 0.0)
+            summed = np.stack([np.bincount(indices, weights=frames[:, i], minlength=unique.shape[0]) for i in range(3)], axis=1)
+            length = np.linalg.norm(summed, axis=1, keepdims=True)
+            unique[:, columns] = np.divide(summed, length, out=np.zeros_like(summed), where=length > 0)
+
+    index_dtype = 'u2' if unique.shape[0] <= 0xFFFF else 'u4'
+    return unique, indices.astype(index_dtype)
+
+_WELD_KEY_COLUMNS = [0, 1, 8, 9, 10, 11, 12, 13] # uv, normal, position
+
+def acmr(indices: np.ndarray, cache_size: int=32) -> float:
+    """ average cache miss ratio (vertex shader invocations per triangle) of an index buffer with a FIFO post-transform cache """
+    cache = deque(maxlen=cache_size)
+    cached = set()
+    misses = 0
+    for vertex in indices.tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        if len(cache) == cache_size:
+            cached.discard(cache[0])
+        cache.append(vertex)
+        cached.add(vertex)
+    return misses / max(1, len(indices) // 3)
+
+def optimize_vertex_cache(indices: np.ndarray, nb_vertices: int, cache_size: int=16) -> np.ndarray:
+    """ reorder triangles for post-transform vertex cache locality (Tipsify, Sander et al. 2007) """
+    triangles = np.asarray(indices).reshape(-1, 3)
+    nb_triangles = triangles.shape[0]
+    if nb_triangles == 0:
+        return np.asarray(indices).copy()
+
+    # vertex -> triangles adjacency (CSR)
+    corners = triangles.ravel().astype(np.int64)
+    live = np.bincount(corners, minlength=nb_vertices)
+    offsets = np.concatenate(([0], np.cumsum(live))).tolist()
+    adjacency = (np.argsort(corners, kind='stable') // 3).tolist()
+    live = live.tolist()
+    triangles = triangles.tolist()
+
+    cache_time = [0] * nb_vertices
+    emitted = [False] * nb_triangles
+    dead_end: list[int] = []
+    output: list[int] = []
+
+    time = cache_size + 1
+    cursor = 0
+    fanning = 0
+    while fanning >= 0:
+        candidates = []
+
+        # emit all the remaining triangles around the fanning vertex
+        for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            for v in triangles[t]:
+                output.append(v)
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - cache_time[v] > cache_size:
+                    cache_time[v] = time
+                    time += 1
+
+        # next fanning vertex: the oldest candidate still in cache after emitting its remaining triangles
+        fanning, best = -1, -1
+        for v in candidates:
+            if live[v] <= 0:
+                continue
+            priority = 0
+            if time - cache_time[v] + 2 * live[v] <= cache_size:
+                priority = time - cache_time[v]
+            if priority > best:
+                fanning, best = v, priority
+
+        # dead end: most recently used vertex with remaining triangles, else the next vertex in input order
+        while fanning == -1 and dead_end:
+            v = dead_end.pop()
+            if live[v] > 0:
+                fanning = v
+        while fanning == -1 and cursor < nb_vertices:
+            if live[cursor] > 0:
+                fanning = cursor
+            cursor += 1
+
+    return np.array(output, dtype=np.asarray(indices).dtype)
+
+def optimize_vertex_fetch(vertices: np.ndarray, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ reorder vertices by first use in the index buffer for vertex fetch locality (unused vertices are dropped) """
+    used, first = np.unique(indices, return_index=True)
+    order = used[np.argsort(first)]
+    remap = np.zeros(vertices.shape[0], dtype=indices.dtype)
+    remap[order] = np.arange(order.shape[0], dtype=indices.dtype)
+    return vertices[order], remap[indices]
+
+def optimize_mesh(vertices: np.ndarray, indices: np.ndarray, name: str="mesh") -> tuple[np.ndarray, np.ndarray]:
+    """ vertex cache then vertex fetch optimization of an indexed mesh, ACMR before/after is logged """
+    acmr_before = acmr(indices)
+    indices = optimize_vertex_cache(indices, vertices.shape[0])
+    vertices, indices = optimize_vertex_fetch(vertices, indices)
+    Log.print(f"{name}: ACMR {acmr_before:.3f} -> {acmr(indices):.3f} ({indices.shape[0] // 3} triangles, {vertices.shape[0]} vertices)")
+    return vertices, indices
+
+MESH_PIPELINE_VERSION = 2 # bump when the processing done after baking changes (invalidates the mesh cache)
+
+MDL_FACE_SIZE = 3 * 8 * 4      # (v2f uv, v3f normal, v3f position) * 3 vertices
+BAKED_VERTEX_SIZE = 14 * 4     # (v2f uv, v3f tangent, v3f bitangent, v3f normal, v3f position)
+MDL_CHUNK_FACES = 1 << 14      # faces read and baked at once by stream_mdl (~1.5MB in, ~2.6MB out)
+
+def stream_mdl(path: Path, chunk_faces: int=MDL_CHUNK_FACES, progress: BakeProgress | None=None, out: np.ndarray | None=None, digest: 'hashlib._Hash | None'=None) -> Iterator[tuple[int, np.ndarray]]:
+    """ read and bake a .mdl file by face-aligned chunks, yielding (first vertex, baked vertices) for each chunk """
+    # the input chunk and the baked chunk are reused between iterations: consume (upload/copy) a chunk before asking for the next one
+    # if out is given ((nb_faces*3, 14) float32), chunks are baked in place into it instead
+    path = Path(path)
+    nb_faces = path.stat().st_size // MDL_FACE_SIZE
+
+    chunk = bytearray(chunk_faces * MDL_FACE_SIZE)
+    baked = np.empty((chunk_faces * 3, 14), dtype='f4') if out is None else None
+    first_face = 0
+
+    with open(path, "rb") as file:
+        while size := file.readinto(chunk):
+            assert size % MDL_FACE_SIZE == 0, f"{path.name}: truncated face at byte {first_face * MDL_FACE_SIZE + size - size % MDL_FACE_SIZE}"
+            data = memoryview(chunk)[:size]
+            if digest is not None:
+                digest.update(data)
+
+            count = size // MDL_FACE_SIZE
+            target = baked[:count * 3] if out is None else out[first_face * 3:(first_face + count) * 3]
+            bake_tangants(data, out=target)
+
+            yield first_face * 3, target
 
-def new_arrow() -> np.ndarray:
-    """ load the arrow model """
+            first_face += count
+            if progress is not None:
+                progress(first_face, nb_faces)
+
+def upload_mdl(ctx: 'mgl.Context', path: Path, chunk_faces: int=MDL_CHUNK_FACES, progress: BakeProgress | None=None) -> tuple['mgl.Buffer', int]:
+    """ stream a .mdl file into a new non-indexed vertex buffer, returns (buffer, number of vertices) """
+    # peak memory is one chunk: each baked chunk goes straight to its range of the gpu buffer
+    # no welding nor caching, meant for large models that are loaded once (use load_mdl() for indexed, cached meshes)
+    # opt-in: the new_* constructors use load_mdl(), their vertices are also needed on the CPU (ie. pack_compact), see doc/notes.md
+    # render with program.vertex_array(buffer) (no index buffer)
+    nb_vertices = Path(path).stat().st_size // MDL_FACE_SIZE * 3
+    buffer = ctx.buffer(reserve=max(1, nb_vertices * BAKED_VERTEX_SIZE))
+    for first_vertex, vertices in stream_mdl(path, chunk_faces, progress):
+        buffer.write(vertices, offset=first_vertex * BAKED_VERTEX_SIZE)
+    return buffer, nb_vertices
+
+def load_mdl(path: Path, progress: BakeProgress | None=None) -> tuple[np.ndarray, np.ndarray]:
+    """ load a .mdl model as (vertices, indices), baked and welded once then memory-mapped from the mesh cache """
     # format of data within the mdl file: (v2f uv,v3f normal,v3f position) * number of vertices
-    # calls bake_tangants() to add tangant and bitangent to the vertices
-    # output format: (v2f uv, v3f tangent, v3f bitangent,v3f normal,v3f position) * number of vertices
-    return np.fromstring(bake_tangants(Path("./res/mdl/arrow.mdl").read_bytes()), dtype='f4').reshape(-1, 14)
+    # calls stream_mdl() to bake tangant and bitangent by chunks, weld() to index them, then optimize_mesh() to reorder them
+    # output format: (v2f uv, v3f tangent, v3f bitangent,v3f normal,v3f position) * number of unique vertices, u2/u4 indices
+    path = Path(path).resolve()
+    stat = path.stat()
+
+    # cache entry: <name>.json (source path, mtime, size, content hash, versions) + <name>.f4 (vertices) + <name>.idx (indices)
+    entry = CACHE.MESH_FOLDER.joinpath(f"{path.stem}-{key_hash(path)}")
+    meta_path, vertices_path, indices_path = entry.with_suffix(".json"), entry.with_suffix(".f4"), entry.with_suffix(".idx")
+
+    meta = read_meta(meta_path)
+    if meta is not None and meta.get("version") == BAKE_TANGANTS_VERSION and meta.get("pipeline") == MESH_PIPELINE_VERSION \
+        and vertices_path.exists() and indices_path.exists():
+        if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            return _load_cached_mesh(vertices_path, indices_path, meta)
+
+        # touched but maybe not modified: compare contents before baking again
+        if meta["size"] == stat.st_size and meta["sha1"] == file_hash(path):
+            meta["mtime_ns"] = stat.st_mtime_ns
+            try:
+                write_meta(meta_path, meta)
+            except OSError:
+                pass
+            return _load_cached_mesh(vertices_path, indices_path, meta)
+
+    # bake by chunks straight into the final array, the raw file is never held in memory at once
+    digest = hashlib.sha1()
+    baked = np.empty((stat.st_size // MDL_FACE_SIZE * 3, 14), dtype='f4')
+    for _ in stream_mdl(path, progress=progress, out=baked, digest=digest):
+        pass
+
+    vertices, indices = weld(baked, smooth_tangents=True)
+    del baked
+    vertices, indices = optimize_mesh(vertices, indices, path.name)
 
-def new_cube() -> np.ndarray:
-    """ create a cube model """
+    try:
+        write_atomic(vertices_path, vertices.tofile)
+        write_atomic(indices_path, indices.tofile)
+        write_meta(meta_path, { # written last: a meta file always describes complete data files
+            "source"  : str(path),
+            "mtime_ns": stat.st_mtime_ns,
+            "size"    : stat.st_size,
+            "sha1"    : digest.hexdigest(),
+            "version" : BAKE_TANGANTS_VERSION,
+            "pipeline": MESH_PIPELINE_VERSION,
+            "vertices": vertices.shape[0],
+            "indices" : indices.shape[0],
+            "index_dtype": indices.dtype.str
+        })
+    except OSError as e:
+        print(f"\x1b[33mCan't write mesh cache for {path.name}: {e}\x1b[0m")
+
+    return vertices, indices
+
+def _load_cached_mesh(vertices_path: Path, indices_path: Path, meta: dict) -> tuple[np.ndarray, np.ndarray]:
+    """ map a cached mesh without copying it """
+    if meta["vertices"] == 0:
+        return np.empty((0, 14), dtype='f4'), np.empty(0, dtype=meta["index_dtype"])
+    vertices = np.memmap(vertices_path, dtype='f4', mode='r', shape=(meta["vertices"], 14))
+    indices = np.memmap(indices_path, dtype=meta["index_dtype"], mode='r', shape=(meta["indices"],))
+    return vertices, indices
+
+def new_sphere() -> tuple[np.ndarray, np.ndarray]:
+    """ load the sphere model (vertices, indices) """
+    return load_mdl(Path("./res/mdl/sphere.mdl"))
+
+def new_arrow() -> tuple[np.ndarray, np.ndarray]:
+    """ load the arrow model (vertices, indices) """
+    return load_mdl(Path("./res/mdl/arrow.mdl"))
+
+def new_cube() -> tuple[np.ndarray, np.ndarray]:
+    """ create a cube model (vertices, indices) """
     tex_coord_vertices = [(0, 0), (1, 0), (1, 1), (0, 1)]
     tex_coord_indices = [(0, 2, 3), (0, 1, 2), (0, 2, 3), (0, 1, 2), (0, 1, 2), (2, 3, 0), (2, 3, 0), (2, 0, 1), (0, 2, 3), (0, 1, 2), (3, 1, 2), (3, 0, 1)]
     tex_coord_data = np.array(triangulate(tex_coord_vertices, tex_coord_indices), dtype='f4')
@@ -74,10 +310,103 @@ def new_cube() -> np.ndarray:
     vertex_data = np.array(primitive_cube(), dtype='f4')
     vertex_data = np.hstack([normals, vertex_data])
     vertex_data = np.hstack([tex_coord_data, vertex_data])
-    return np.fromstring(bake_tangants(vertex_data.tobytes()), dtype='f4').reshape(-1, 14)
+    return weld(bake_tangants(vertex_data), smooth_tangents=True)
 
 def new_triangle_screen() -> np.ndarray:
     """ create a triangle that covers the entire screen """
     primitive = np.array(primitive_triangle(((-1, -1), (3, 3))), dtype='f4')
     primitive_back = np.array([(px, py, 0.9999) for px, py in primitive], dtype='f4')
     return primitive_back
+
+
+# compact vertex format (24 bytes instead of 56), matches Program.COMPACT_FMTS and decode_tbn() in common.vert
+COMPACT_DTYPE = np.dtype([
+    ("uv",       'f2', 2), # half float uv
+    ("tbn",      'i2', 4), # snorm16: xy octahedral normal, z tangent angle around the normal / pi, w bitangent sign
+    ("position", 'f4', 3)
+])
+
+def _octahedral_encode(normals: np.ndarray) -> np.ndarray:
+    """ unit vectors -> octahedral coordinates in [-1, 1]^2 """
+    n = normals / np.sum(np.abs(normals), axis=1, keepdims=True)
+    sign = np.where(n[:, :2] >= 0.0, 1.0, -1.0)
+    folded = (1.0 - np.abs(n[:, 1::-1])) * sign # (1 - |n.yx|) * sign(n.xy)
+    return np.where(n[:, 2:3] < 0.0, folded, n[:, :2])
+
+def _octahedral_decode(encoded: np.ndarray) -> np.ndarray:
+    """ octahedral coordinates -> unit vectors (same as decode_octahedral() in common.vert) """
+    n = np.concatenate([encoded, 1.0 - np.sum(np.abs(encoded), axis=1, keepdims=True)], axis=1)
+    sign = np.where(n[:, :2] >= 0.0, 1.0, -1.0)
+    folded = (1.0 - np.abs(n[:, 1::-1])) * sign
+    n[:, :2] = np.where(n[:, 2:3] < 0.0, folded, n[:, :2])
+    return n / np.linalg.norm(n, axis=1, keepdims=True)
+
+def _orthonormal_basis(normals: np.ndarray, sign: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ basis around unit normals of the given hemisphere sign (Duff et al. 2017, same as orthonormal_basis() in common.vert) """
+    x, y, z = normals[:, 0], normals[:, 1], normals[:, 2]
+    a = -1.0 / (sign + z)
+    b = x * y * a
+    b1 = np.stack([1.0 + sign * x * x * a, sign * b, -sign * x], axis=1)
+    b2 = np.stack([b, sign + y * y * a, -y], axis=1)
+    return b1, b2
+
+def pack_compact(vertices: np.ndarray) -> np.ndarray:
+    """ pack (uv, bitangent, tangent, normal, position) float vertices into the 24 bytes COMPACT_DTYPE layout """
+    # the tangent is orthogonalized against the normal and the bitangent rebuilt from cross(normal, tangent) and its sign
+    vertices = np.asarray(vertices, dtype='f4').reshape(-1, 14).astype('f8')
+    bitangent, tangent, normal = vertices[:, 2:5], vertices[:, 5:8], vertices[:, 8:11]
+
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = np.divide(normal, length, out=np.tile((0.0, 0.0, 1.0), (len(normal), 1)), where=length > 0.0) # degenerated (zero or nan) normals face +z
+    snorm_normal = np.round(np.clip(_octahedral_encode(normal), -1.0, 1.0) * 32767.0)
+
+    # tangent angle measured in the basis the shader rebuilds from the quantized normal
+    hemisphere = np.where(np.abs(snorm_normal[:, 0]) + np.abs(snorm_normal[:, 1]) > 32767.0, -1.0, 1.0)
+    b1, b2 = _orthonormal_basis(_octahedral_decode(snorm_normal / 32767.0), hemisphere)
+    length = np.linalg.norm(tangent, axis=1, keepdims=True)
+    tangent = np.divide(tangent, length, out=b1.copy(), where=length > 0.0) # degenerated tangents: angle 0 (the first basis vector)
+    with np.errstate(invalid='ignore'):
+        angle = np.arctan2(np.sum(tangent * b2, axis=1), np.sum(tangent * b1, axis=1)) / np.pi
+        handedness = np.where(np.sum(np.cross(normal, tangent) * bitangent, axis=1) < 0.0, -1.0, 1.0)
+    angle = np.nan_to_num(angle) # degenerated tangent frames
+
+    packed = np.empty(vertices.shape[0], dtype=COMPACT_DTYPE)
+    packed["uv"] = vertices[:, 0:2]
+    packed["tbn"][:, 0:2] = snorm_normal
+    packed["tbn"][:, 2] = np.round(angle * 32767.0)
+    packed["tbn"][:, 3] = handedness * 32767.0
+    packed["position"] = vertices[:, 11:14]
+    return packed
+
+
+if __name__ == "__main__":
+    # checks (run from the project root): python -m AGELite.core.geometry
+    import warnings
+    warnings.simplefilter("error", RuntimeWarning) # nan/inf in the packing fail the checks
+
+    # compact packing: decoded normals match, degenerated frames (zero normal or tangent) get the +z fallback instead of undefined values
+    vertices = np.array(new_arrow()[0])
+    zero = np.linalg.norm(vertices[:, 8:11], axis=1) == 0.0 # the arrow model has zero normals
+    assert zero.any(), "no zero normal in arrow.mdl"
+    valid = np.flatnonzero(~zero)
+    vertices[valid[0], 5:8] = 0.0      # zero tangent
+    vertices[valid[1], 5:11] = np.nan  # nan frame
+    zero[valid[1]] = True
+    packed = pack_compact(vertices)
+    normals = _octahedral_decode(packed["tbn"][:, 0:2] / 32767.0)
+    assert np.allclose(normals[~zero], vertices[~zero, 8:11] / np.linalg.norm(vertices[~zero, 8:11], axis=1, keepdims=True), atol=1e-3)
+    assert np.allclose(normals[zero], (0.0, 0.0, 1.0))
+    assert packed["tbn"][valid[0], 2] == packed["tbn"][valid[1], 2] == 0, packed["tbn"][valid[:2]]
+    print(f"pack_compact | OK | {np.count_nonzero(zero) - 1} zero normals")
+
+    # streamed upload: same content as baking the whole file at once, across chunk boundaries
+    import moderngl as mgl
+    ctx = mgl.create_standalone_context()
+    path = Path("./res/mdl/arrow.mdl")
+    reported = []
+    buffer, nb_vertices = upload_mdl(ctx, path, chunk_faces=37, progress=lambda baked, total: reported.append((baked, total))) # not a divisor of the face count
+    assert len(reported) > 1
+    expected = bake_tangants(path.read_bytes())
+    assert nb_vertices == expected.shape[0] and reported[-1][0] == reported[-1][1] == nb_vertices // 3
+    assert np.array_equal(np.frombuffer(buffer.read(), dtype='f4').reshape(-1, 14), expected, equal_nan=True)
+    print(f"upload_mdl | OK | {len(reported)} chunks")
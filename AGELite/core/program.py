@@ -1,10 +1,15 @@
+from collections import OrderedDict
+from typing import Callable
 from pathlib import Path
 from os import walk
 import re
+import time
 
 import moderngl as mgl
 
-from .debug import fmt_program_exception_on_build
+from .cache import key_hash
+from .debug import fmt_program_exception_on_build, LINE_BASE
+from .uniform_block import UNIFORM_BLOCK
 from ..imgui.logging import UI_Logger as Log
 
 
@@ -12,6 +17,7 @@ from ..imgui.logging import UI_Logger as Log
 class UniformContext:
     """
     Retreive all uniforms values when entering the context and set them when exiting
+    values are copied from the uniform store of the program (see Program.uniform_state), nothing is read back from the driver
 
     Usage:
         with UniformContext(AGEProgram: Program):
@@ -19,19 +25,50 @@ class UniformContext:
     """
     def __init__(self, program: 'Program'):
         self.program = program
-        self.uniforms = []
+        self.uniforms = {}
 
     def __enter__(self):
         """ Retreive all uniforms values """
-        for elem in [self.program.program.get(k, None) for k in self.program.program]:
-            if isinstance(elem, mgl.Uniform):
-                self.uniforms.append((elem.name, elem.value))
+        self.uniforms = self.program.uniform_state()
 
     def __exit__(self, err_type, err_value, err_traceback):
-        """ Set all uniforms values """
+        """ Set all uniforms values (only the changed ones are sent) """
         if err_type is None: 
-            for uniform in self.uniforms:
-                self.program.set(uniform[0], uniform[1])
+            self.program.restore_uniforms(self.uniforms)
+
+
+
+class VertexArray:
+    """ mgl.VertexArray created by Program.vertex_array, rebuilt when its program is swapped 
+    attributes of the current mgl.VertexArray are forwarded (render, vertices, instances...) """
+    def __init__(self, program: 'Program', content: list[tuple], index_buffer: mgl.Buffer|None=None, index_element_size: int=4):
+        self.program = program
+        self.content = content
+        self.index_buffer = index_buffer
+        self.index_element_size = index_element_size
+        self.vao: mgl.VertexArray = None
+        self.build()
+
+    def build(self):
+        """ (re)create the mgl.VertexArray on the current mgl.Program of the program, keeping its render settings """
+        vao = self.program.ctx.vertex_array(self.program.program, self.content, index_buffer=self.index_buffer, index_element_size=self.index_element_size, skip_errors=True)
+        if self.vao is not None:
+            vao.mode, vao.vertices, vao.instances = self.vao.mode, self.vao.vertices, self.vao.instances
+            self.vao.release()
+        self.vao = vao
+
+    def render(self, *args, **kwargs):
+        self.program.update_variant() # may rebuild self.vao
+        self.vao.render(*args, **kwargs)
+
+    def release(self):
+        """ release the vertex array, it isn't rebuilt anymore """
+        if self in self.program.vertex_arrays:
+            self.program.vertex_arrays.remove(self)
+        self.vao.release()
+
+    def __getattr__(self, name: str):
+        return getattr(self.vao, name)
 
 
 
@@ -46,6 +83,11 @@ class Program:
     PBR_FRAGMENT_PATH     = SHADER_FOLDER.joinpath("pbr.frag")
     DEFAULT_FMTS = "2f 3f 3f 3f 3f"
     DEFAULT_ATTRS = ("in_uv", "in_bitangent","in_tangent", "in_normal", "in_vertex",)
+
+    # compact 24 bytes vertices (see geometry.pack_compact), decoded in common.vert when COMPACT_VERTEX is defined
+    COMPACT_FMTS = "2f2 4i2 3f"
+    COMPACT_ATTRS = ("in_uv", "in_packed_tbn", "in_vertex",)
+    COMPACT_DEFINES = {"COMPACT_VERTEX": "1"}
     
     SKYBOX_VERTEX_PATH   = SHADER_FOLDER.joinpath("skybox.vert")
     SKYBOX_FRAGMENT_PATH = SHADER_FOLDER.joinpath("skybox.frag")
@@ -54,8 +96,23 @@ class Program:
 
     SHADER_INCLUDE_DIRECTORY = "common"
     SHADER_INCLUDE_PATH = SHADER_FOLDER.joinpath(SHADER_INCLUDE_DIRECTORY)
+    INCLUDE_PATTERN = re.compile(r'#include\s+"([^"]+)"[^\n]*')
+    ONCE_PATTERN = re.compile(r"^[ \t]*#pragma[ \t]+once[ \t]*$", flags=re.MULTILINE)
+
+    # expanded sources (see Program.preprocess), keyed on the source and the version of the include files
+    PREPROCESS_CACHE_SIZE = 64
+    _preprocessed: dict[tuple[str, str, int], tuple[str, list[tuple[str, str]]]] = {}
+    includes_version = 0 # incremented when an include file is (re)loaded
 
     List: dict[str, 'Program'] = {}
+
+    SKIP_UNCHANGED_SWAPS = True # swapping to the same resolved sources doesn't compile anything (see Program.swap)
+
+    # variants: uniforms set with Program.set_variant are compiled as #defines, each set of values is a cached mgl.Program
+    USE_VARIANTS = True
+    VARIANT_CACHE_SIZE = 32 # compiled programs kept per Program
+    WARM_UP_BUDGET = 4.0    # ms of variant compilation per frame (see Program.warm_up_step)
+    _warm_up_queue: list[Callable[[], None]] = []
     
     @staticmethod
     def load_shader_file(path: Path):
@@ -86,92 +143,421 @@ class Program:
         return name in Program.List
     
     @staticmethod
-    def create(name: str, ctx: mgl.Context, vertex_shader_path: str=DEFAULT_VERTEX_PATH, fragment_shader_path: str=DEFAULT_FRAGMENT_PATH, formats: str=DEFAULT_FMTS, attrs: tuple[str, ...]=DEFAULT_ATTRS):
+    def create(name: str, ctx: mgl.Context, vertex_shader_path: str=DEFAULT_VERTEX_PATH, fragment_shader_path: str=DEFAULT_FRAGMENT_PATH, formats: str=DEFAULT_FMTS, attrs: tuple[str, ...]=DEFAULT_ATTRS, defines: dict[str, str]|None=None):
         """ create new program """
-        Program.List[name] = Program(ctx, vertex_shader_path, fragment_shader_path, formats, attrs)
+        Program.List[name] = Program(ctx, vertex_shader_path, fragment_shader_path, formats, attrs, defines)
         return Program.List[name]
     
     @staticmethod
     def _load_include_files(ctx: mgl.Context) -> str:
         """ load include files declared with the #include directive """
         if len(ctx.includes) > 0: return #includes already loaded
-        common_path = Program.SHADER_INCLUDE_PATH
-        for _,_,files in walk(common_path):
+        for _,_,files in walk(Program.SHADER_INCLUDE_PATH):
             for file in files:
-                include_key = str(Path(Program.SHADER_INCLUDE_DIRECTORY).joinpath(file).as_posix())
-                data        = common_path.joinpath(file).read_text()
-                ctx.includes[include_key] = f"// INCLUDED FROM {file}\n{data}\n// EOI"
+                Program.load_include_file(ctx, str(Path(Program.SHADER_INCLUDE_DIRECTORY).joinpath(file).as_posix()))
+
+    @staticmethod
+    def load_include_file(ctx: mgl.Context, include_key: str):
+        """ (re)load an include file in ctx.includes """
+        ctx.includes[include_key] = Program.include_path(include_key).read_text()
+        Program.includes_version += 1
+
+    @staticmethod
+    def include_path(include_key: str) -> Path:
+        """ file of an include key (keys are relative to the shader folder) """
+        return Program.SHADER_FOLDER.joinpath(include_key)
+
+    @staticmethod
+    def preprocess(ctx: mgl.Context, source: str, name: str="source") -> tuple[str, list[tuple[str, str]]]:
+        """ expand the #include directives of a source, returns (expanded source, [(name, text) of each source string]) 
+        includes are expanded recursively, files containing #pragma once only once per source 
+        #line directives keep the line numbers of the original files: include K is source string K, numbered from K * LINE_BASE 
+        the result is memoized on the source and the version of the include files """
+        key = (name, source, Program.includes_version)
+        if (result := Program._preprocessed.get(key)) is not None:
+            return result
+
+        files: list[tuple[str, str]] = [(name, source)]
+        numbers: dict[str, int] = {} # include key -> source string number
+        once: set[str] = set()
+
+        def expand(text: str, number: int, stack: tuple[str, ...]) -> str:
+            def include(match: re.Match):
+                include_key = match.group(1)
+                content = ctx.includes.get(include_key)
+                if content is None:
+                    raise KeyError(f'cannot include "{include_key}" in "{files[number][0]}"')
+                if include_key in stack:
+                    raise RecursionError(f'"{include_key}" includes itself (use #pragma once)')
+                if include_key in once:
+                    return "" # the line is kept, the following lines don't move
+
+                if include_key not in numbers:
+                    numbers[include_key] = len(files)
+                    files.append((include_key, content))
+                include_number = numbers[include_key]
+                if Program.ONCE_PATTERN.search(content):
+                    once.add(include_key)
+
+                line = text.count("\n", 0, match.start()) + 1 + number * LINE_BASE
+                body = expand(Program.ONCE_PATTERN.sub("", content), include_number, (*stack, include_key))
+                return f"// INCLUDED FROM {include_key}\n#line {include_number * LINE_BASE + 1} {include_number}\n{body}\n// EOI\n#line {line + 1} {number}"
+            return Program.INCLUDE_PATTERN.sub(include, text)
+
+        result = expand(source, 0, ()), files
+        Program._preprocessed[key] = result
+        while len(Program._preprocessed) > Program.PREPROCESS_CACHE_SIZE:
+            del Program._preprocessed[next(iter(Program._preprocessed))]
+        return result
 
     @staticmethod
-    def resolve_includes(ctx: mgl.Context, source: str):
-        """ Extracted from moderngl.py source as-is. All copyrights belong to their respective owners. """
-        def include(match: re.Match):
-            name = match.group(1)
-            content = ctx.includes.get(name)
-            if content is None:
-                raise KeyError(f'cannot include "{name}"')
-            return content
-        source = re.sub(r'#include\s+"([^"]+)"', include, source)
+    def resolve_includes(ctx: mgl.Context, source: str, includes: set[str]|None=None):
+        """ expand the #include directives of a source (see Program.preprocess), the included keys are added to includes """
+        source, files = Program.preprocess(ctx, source)
+        if includes is not None:
+            includes.update(name for name, _ in files[1:])
         return source
 
+    @staticmethod
+    def source_hash(vertex_shader: str, fragment_shader: str) -> str:
+        """ hash of resolved shader sources, keys the compiled programs of a Program (not persisted: they only live in its context) """
+        return key_hash(vertex_shader, fragment_shader)
+
+    @staticmethod
+    def inject_defines(source: str, defines: dict[str, str]|None):
+        """ insert #define directives right after the #version directive """
+        if not defines:
+            return source
+        block = "\n".join(f"#define {name} {value}" for name, value in defines.items())
+        version = re.search(r"^[ \t]*#version.*$", source, flags=re.MULTILINE)
+        if version is None:
+            return f"{block}\n#line 1 0\n{source}"
+        line = source.count("\n", 0, version.start()) + 1
+        return f"{source[:version.end()]}\n{block}\n#line {line + 1} 0{source[version.end():]}" # following lines keep their number
+
 
-    def __init__(self, ctx: mgl.Context, vertex_shader_path: Path=DEFAULT_VERTEX_PATH, fragment_shader_path: Path=DEFAULT_FRAGMENT_PATH, formats: str=DEFAULT_FMTS, attrs: tuple[str, ...]=DEFAULT_ATTRS):
+    def __init__(self, ctx: mgl.Context, vertex_shader_path: Path=DEFAULT_VERTEX_PATH, fragment_shader_path: Path=DEFAULT_FRAGMENT_PATH, formats: str=DEFAULT_FMTS, attrs: tuple[str, ...]=DEFAULT_ATTRS, defines: dict[str, str]|None=None):
         self._load_include_files(ctx)
         self.ctx = ctx
-        self.vertex_shader = Program.load_shader_file(vertex_shader_path)
-        self.fragment_shader = Program.load_shader_file(fragment_shader_path)
+        self.defines = defines or {}
+        self.features: dict[str, str] = {} # variant defines (see Program.set_variant)
+        self._features_changed = False
+        self.block_bindings = {name: binding.value for name, binding in UNIFORM_BLOCK.BINDING_BY_NAME.items()} # uniform block -> binding point (see UniformBlock)
 
-        self.vertex_shader = Program.resolve_includes(self.ctx, self.vertex_shader)
-        self.fragment_shader = Program.resolve_includes(self.ctx, self.fragment_shader)
+        # shader files and their source strings: the file then its includes (see Program.preprocess, ShaderWatcher)
+        self.vertex_shader_path, self.fragment_shader_path = Path(vertex_shader_path), Path(fragment_shader_path)
+        self.vertex_shader, self.vertex_files = self._load_stage(self.vertex_shader_path)
+        self.fragment_shader, self.fragment_files = self._load_stage(self.fragment_shader_path)
 
         try:
             self.program = self.ctx.program(self.vertex_shader, self.fragment_shader)
         except Exception as e:
-            raise fmt_program_exception_on_build(self.vertex_shader, self.fragment_shader, e)
+            raise fmt_program_exception_on_build(self.vertex_shader, self.fragment_shader, e, vertex_files=self.vertex_files, fragment_files=self.fragment_files)
+        self._bind_blocks(self.program)
+
+        self.source_key = Program.source_hash(self.vertex_shader, self.fragment_shader) # sources of self.program
+        self.variants: OrderedDict[str, mgl.Program] = OrderedDict({self.source_key: self.program}) # source key -> compiled program, least recently used first
+        self.uniforms: dict[str, object] = {} # key -> last value set (bytes of buffers, see Program.snapshot), applied to every variant made current
+        self.handles: dict[str, mgl.Uniform | None] = {} # key -> uniform of self.program, resolved once (None if it doesn't exist)
+        self.counters = {"writes": 0, "skips": 0, "lookups": 0} # GL uniform updates, unchanged values skipped, handles resolved through moderngl
 
         self.formats = formats
         self.attrs = attrs
 
+        self.vertex_arrays: list[VertexArray] = [] # rebuilt against the new mgl.Program on swap
+
+
+    def vertex_array(self, buffer: mgl.Buffer, index_buffer: mgl.Buffer|None=None, index_element_size: int=4) -> 'VertexArray':
+        """ create a vertex array of a buffer with the program formats and attributes, it follows the program through swaps """
+        vertex_array = VertexArray(self, [(buffer, self.formats, *self.attrs)], index_buffer, index_element_size)
+        self.vertex_arrays.append(vertex_array)
+        return vertex_array
+
+
+    def _build_stage(self, source: str, name: str, features: dict[str, str] | None=None) -> tuple[str, list[tuple[str, str]]]:
+        """ preprocessed source of a stage with the program defines and features, and its source strings (see Program.preprocess) """
+        source, files = Program.preprocess(self.ctx, source, name)
+        features = self.features if features is None else features
+        return Program.inject_defines(source, {**self.defines, **dict(sorted(features.items()))}), files
+
+    def _load_stage(self, path: Path, features: dict[str, str] | None=None) -> tuple[str, list[tuple[str, str]]] | None:
+        """ _build_stage of a shader file, None if the file doesn't exist """
+        if (source := Program.load_shader_file(Path(path))) is None:
+            return None
+        return self._build_stage(source, str(Path(path).as_posix()), features)
+
+    def dependencies(self) -> set[Path]:
+        """ files the program is built from: its shader files and their includes (nested ones too) """
+        include_keys = {name for name, _ in self.vertex_files[1:] + self.fragment_files[1:]}
+        return {self.vertex_shader_path, self.fragment_shader_path} | {Program.include_path(include_key) for include_key in include_keys}
+
+    def _compile(self, vertex_shader: str, fragment_shader: str, vertex_files: list[tuple[str, str]], fragment_files: list[tuple[str, str]]) -> tuple[str, mgl.Program]:
+        """ (source key, program) of sources, from the variants or compiled and added to them """
+        source_key = Program.source_hash(vertex_shader, fragment_shader)
+        if source_key in self.variants:
+            self.variants.move_to_end(source_key)
+            return source_key, self.variants[source_key]
+        try:
+            program = self.ctx.program(vertex_shader, fragment_shader)
+        except Exception as e:
+            raise fmt_program_exception_on_build(vertex_shader, fragment_shader, e, vertex_files=vertex_files, fragment_files=fragment_files)
+        self._bind_blocks(program)
+
+        self.variants[source_key] = program
+        for old_key in list(self.variants)[:max(0, len(self.variants) - Program.VARIANT_CACHE_SIZE)]:
+            if old_key != self.source_key: # the current program is never released
+                self.variants.pop(old_key).release()
+        return source_key, program
+
+    def _use(self, vertex_shader: str, fragment_shader: str, vertex_files: list[tuple[str, str]], fragment_files: list[tuple[str, str]]):
+        """ make the program of these sources current (see notes.md -> Program shader hotswap) """
+        recompile = not Program.SKIP_UNCHANGED_SWAPS and Program.source_hash(vertex_shader, fragment_shader) == self.source_key
+        if recompile:
+            del self.variants[self.source_key] # compiled again below, the current program is kept if it fails
+        try:
+            source_key, program = self._compile(vertex_shader, fragment_shader, vertex_files, fragment_files)
+        except Exception:
+            if recompile: self.variants[self.source_key] = self.program
+            raise
+
+        if program is not self.program:
+            if recompile: self.program.release()
+            self.program, self.source_key = program, source_key
+            self.handles = {}
+            for key, value in self.uniforms.items(): # the new program starts with the uniform values of the previous one
+                if (uniform := self._handle(key)) is not None:
+                    Program._apply(uniform, value)
+            for vertex_array in self.vertex_arrays:
+                vertex_array.build()
+
+        self.vertex_shader, self.vertex_files = vertex_shader, vertex_files
+        self.fragment_shader, self.fragment_files = fragment_shader, fragment_files
 
     def swap(self, vertex_shader_path: Path|None=None, fragment_shader_path: Path|None=None):
-        """ swap vertex and fragment shaders """
-        if vertex_shader_path is not None:
-            self.vertex_shader   = Program.load_shader_file(vertex_shader_path) or self.vertex_shader
-            self.vertex_shader = Program.resolve_includes(self.ctx, self.vertex_shader)
-
-        if fragment_shader_path is not None:
-            self.fragment_shader = Program.load_shader_file(fragment_shader_path) or self.fragment_shader
-            self.fragment_shader = Program.resolve_includes(self.ctx, self.fragment_shader)
-
-        try:                                                                                            #
-            _program = self.ctx.program(self.vertex_shader, self.fragment_shader)                       #
-            _program.release()                                                                          #
-        except Exception as e:                                                                          #  see notes.md -> Program shader hotswap
-            raise fmt_program_exception_on_build(self.vertex_shader, self.fragment_shader, e)           # 
-        else:                                                                                           #
-            with UniformContext(self):                                                                  #
-                self.program.release()                                                                  #                                   
-                self.program = self.ctx.program(self.vertex_shader, self.fragment_shader)               #
+        """ swap vertex and fragment shaders: compiled once (or taken from the variants), then the vertex arrays of the program are rebuilt on the new mgl.Program 
+        nothing is compiled if the resolved sources didn't change, the previous program is kept if the new one doesn't compile """
+        vertex = self._load_stage(vertex_shader_path) if vertex_shader_path is not None else None
+        fragment = self._load_stage(fragment_shader_path) if fragment_shader_path is not None else None
+        vertex_shader, vertex_files = vertex or (self.vertex_shader, self.vertex_files)
+        fragment_shader, fragment_files = fragment or (self.fragment_shader, self.fragment_files)
+
+        self._use(vertex_shader, fragment_shader, vertex_files, fragment_files)
+        if vertex is not None: self.vertex_shader_path = Path(vertex_shader_path)
+        if fragment is not None: self.fragment_shader_path = Path(fragment_shader_path)
+
+    def reload(self):
+        """ compile the program again from its shader files (ie. after they changed on disk, see ShaderWatcher) """
+        self.swap(self.vertex_shader_path, self.fragment_shader_path)
+        for source_key in [source_key for source_key in self.variants if source_key != self.source_key]: # compiled from the previous files
+            self.variants.pop(source_key).release()
+
+
+    def set_variant(self, program_key: str, value: int | bool):
+        """ set a uniform selecting a variant of the program 
+        with Program.USE_VARIANTS it is compiled as the #define PROGRAM_KEY (see uio.frag) so branches on it are resolved at compile time, 
+        the variant is made current on the next render of a vertex array of the program """
+        if not Program.USE_VARIANTS:
+            self.set(program_key, value)
+            return
+        define = str(int(value))
+        if self.features.get(program_key.upper()) != define:
+            self.features[program_key.upper()] = define
+            self._features_changed = True
+
+    def update_variant(self):
+        """ make the variant of the current features current, compiled if needed (called before rendering) """
+        if not self._features_changed:
+            return
+        self._features_changed = False
+        vertex_shader, vertex_files = self._build_stage(self.vertex_files[0][1], self.vertex_files[0][0])
+        fragment_shader, fragment_files = self._build_stage(self.fragment_files[0][1], self.fragment_files[0][0])
+        self._use(vertex_shader, fragment_shader, vertex_files, fragment_files)
+
+    def warm_up(self, features: list[dict[str, int | bool]], fragment_shader_paths: tuple[Path | None, ...]=(None,)):
+        """ queue the compilation of variants ahead of their use (see Program.warm_up_step) 
+        features are {program key: value} merged over the current features when compiled, None paths are the current fragment shader """
+        if not Program.USE_VARIANTS:
+            return
+        def compile_variant(variant: dict[str, int | bool], fragment_shader_path: Path | None):
+            variant_features = {**self.features, **{key.upper(): str(int(value)) for key, value in variant.items()}}
+            vertex = self._build_stage(self.vertex_files[0][1], self.vertex_files[0][0], variant_features)
+            if fragment_shader_path is None:
+                fragment = self._build_stage(self.fragment_files[0][1], self.fragment_files[0][0], variant_features)
+            elif (fragment := self._load_stage(fragment_shader_path, variant_features)) is None:
+                return
+            vertex_shader, vertex_files = vertex
+            fragment_shader, fragment_files = fragment
+            try:
+                self._compile(vertex_shader, fragment_shader, vertex_files, fragment_files)
+            except Exception as e:
+                Log.print(f"Can't warm up a variant of '{Program.get_name(self)}': {e}")
+        for fragment_shader_path in fragment_shader_paths:
+            Program._warm_up_queue.extend(lambda variant=variant, path=fragment_shader_path: compile_variant(variant, path) for variant in features)
+
+    @staticmethod
+    def warm_up_step(budget: float | None=None) -> int:
+        """ compile queued variants for up to budget ms (Program.WARM_UP_BUDGET if None, at least one), returns the number left """
+        budget = Program.WARM_UP_BUDGET if budget is None else budget
+        start = time.perf_counter()
+        while Program._warm_up_queue:
+            Program._warm_up_queue.pop(0)()
+            if (time.perf_counter() - start) * 1e3 >= budget:
+                break
+        return len(Program._warm_up_queue)
+
+
+    def _bind_blocks(self, program: mgl.Program):
+        """ set the binding point of the uniform blocks of a compiled program (GLSL 330 has no layout(binding)) """
+        for name, binding in self.block_bindings.items():
+            if name in program:
+                program[name].binding = binding
+
+    def bind_block(self, name: str, binding: UNIFORM_BLOCK.BINDING):
+        """ read a uniform block from another binding point (ie. a UniformBlock of its own), for every variant """
+        self.block_bindings[name] = binding.value
+        for program in self.variants.values():
+            self._bind_blocks(program)
+
+
+    @staticmethod
+    def snapshot(value):
+        """ copy of a uniform value to compare it with the next one: bytes in memory order of buffers (glm), the value otherwise """
+        if isinstance(value, (bool, int, float, tuple)):
+            return value
+        try:
+            return memoryview(value).tobytes(order="A") # glm matrices are column major
+        except TypeError:
+            return tuple(value)
+
+    @staticmethod
+    def _apply(uniform: mgl.Uniform, value):
+        """ send a snapshot to a uniform """
+        if isinstance(value, bytes): uniform.write(value)
+        else:                        uniform.value = value
 
+    def _handle(self, program_key: str) -> mgl.Uniform | None:
+        """ uniform of the current program, resolved once per program """
+        if program_key not in self.handles:
+            self.counters["lookups"] += 1
+            self.handles[program_key] = self.program.get(program_key, None)
+        return self.handles[program_key]
 
     def getu(self, program_key: str, default=None):
         """ get uniform by key """
-        if program_key in self.program:
-            return self.program[program_key]
+        if (uniform := self._handle(program_key)) is not None:
+            return uniform
         else:
             Log.print(f"Unknown program key to get: '{program_key}' for Program '{Program.get_name(self)}'")
             return default
 
+    def _update(self, program_key: str, value, action: str):
+        """ send a snapshot to the uniform if it changed since the last set/write """
+        if program_key in self.uniforms and self.uniforms[program_key] == value:
+            self.counters["skips"] += 1
+            return
+        self.uniforms[program_key] = value
+        if (uniform := self._handle(program_key)) is not None:
+            Program._apply(uniform, value)
+            self.counters["writes"] += 1
+        elif not any(program_key in program for program in self.variants.values()): # can be optimized out of some variants only
+            Log.print(f"Unknown program key to {action}: '{program_key}' for Program '{Program.get_name(self)}'")
+
+    def uniform_state(self) -> dict[str, object]:
+        """ copy of the uniform values set through set/write, the authoritative state of the program uniforms (see UniformContext) """
+        return dict(self.uniforms)
+
+    def restore_uniforms(self, state: dict[str, object]):
+        """ set back the values of a uniform_state, only the ones changed since are sent """
+        for program_key, value in state.items():
+            self._update(program_key, value, "restore")
+
     def set(self, program_key, value):
-        """ set uniform by key """
-        if program_key in self.program:
-            self.program[program_key] = value
-        else:
-            Log.print(f"Unknown program key to set: '{program_key}' for Program '{Program.get_name(self)}'")
+        """ set uniform by key (skipped if unchanged) """
+        self._update(program_key, Program.snapshot(value), "set")
         
     def write(self, program_key, value):
-        """ write uniform by key """
-        if program_key in self.program:
-            self.program[program_key].write(value)
-        else:
-            Log.print(f"Unknown program key to write: '{program_key}' for Program '{Program.get_name(self)}'")
+        """ write uniform by key (skipped if unchanged) """
+        self._update(program_key, memoryview(value).tobytes(order="A"), "write")
+
+if __name__ == "__main__":
+    # benchmark (run from the project root): python -m AGELite.core.program [swaps]
+    import sys
+    import time
+
+    def _legacy_swap(program: Program, vertex_shader_path: Path, fragment_shader_path: Path):
+        """ previous hot-swap: a validation compile, then a second one reusing the released glo (see notes.md) """
+        program.vertex_shader = Program.resolve_includes(program.ctx, Program.inject_defines(Program.load_shader_file(vertex_shader_path), program.defines))
+        program.fragment_shader = Program.resolve_includes(program.ctx, Program.inject_defines(Program.load_shader_file(fragment_shader_path), program.defines))
+        _program = program.ctx.program(program.vertex_shader, program.fragment_shader)
+        _program.release()
+        with UniformContext(program):
+            program.program.release()
+            program.program = program.ctx.program(program.vertex_shader, program.fragment_shader)
+        program.source_key = Program.source_hash(program.vertex_shader, program.fragment_shader)
+        program.variants = OrderedDict({program.source_key: program.program})
+
+    ctx = mgl.create_standalone_context()
+    swaps = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    start = time.perf_counter()
+    programs = [Program.create(name, ctx, vertex, fragment) for name, vertex, fragment in (
+        ("default", Program.DEFAULT_VERTEX_PATH, Program.DEFAULT_FRAGMENT_PATH),
+        ("skybox", Program.SKYBOX_VERTEX_PATH, Program.SKYBOX_FRAGMENT_PATH),
+        ("blank", Program.SHADER_FOLDER.joinpath("blank.vert"), Program.SHADER_FOLDER.joinpath("blank.frag")))]
+    print(f"{'startup':>10} | {(time.perf_counter() - start) * 1e3:8.2f} ms | {len(programs)} programs")
+
+    program = Program.get("default")
+    vertex_arrays = [program.vertex_array(ctx.buffer(reserve=56 * 3)) for _ in range(8)] # rebuilt on each swap
+    for name, swap in (("legacy", lambda *paths: _legacy_swap(program, *paths)), ("swap", program.swap)):
+        timings = {"toggle": [], "unchanged": []}
+        for i in range(swaps):
+            fragment_shader_path = Program.PBR_FRAGMENT_PATH if i % 2 == 0 else Program.DEFAULT_FRAGMENT_PATH
+            for kind in timings:
+                start = time.perf_counter()
+                swap(Program.DEFAULT_VERTEX_PATH, fragment_shader_path)
+                timings[kind].append(time.perf_counter() - start)
+        for kind, timing in timings.items():
+            print(f"{name:>6} {kind:>9} | best {min(timing)*1e3:8.2f} ms | mean {sum(timing)/swaps*1e3:8.2f} ms")
+    assert all(vertex_array.vao.program is program.program for vertex_array in vertex_arrays)
+
+    # variants: the first use of a feature value compiles, the next ones only rebuild the vertex arrays
+    timings = {"compile": [], "cached": []}
+    for kind in timings:
+        for maps in range(swaps):
+            start = time.perf_counter()
+            program.set_variant("enabled_maps", maps)
+            program.update_variant()
+            timings[kind].append(time.perf_counter() - start)
+    for kind, timing in timings.items():
+        print(f"{'variant':>6} {kind:>9} | best {min(timing)*1e3:8.2f} ms | mean {sum(timing)/swaps*1e3:8.2f} ms")
+
+    # uniforms: cached handles, unchanged values skip the GL call
+    def _legacy_write(program: Program, program_key: str, value):
+        if program_key in program.program:
+            program.program[program_key].write(value)
+
+    import glm
+    m_model, writes = glm.mat4(), 10000
+    for name, write in (("legacy", lambda value: _legacy_write(program, "m_model", value)), ("write", lambda value: program.write("m_model", value))):
+        for kind in ("unchanged", "changed"):
+            start = time.perf_counter()
+            for i in range(writes):
+                write(glm.translate(m_model, glm.vec3(i)) if kind == "changed" else m_model)
+            print(f"{name:>6} {kind:>9} | mean {(time.perf_counter() - start) / writes * 1e6:8.2f} us")
+    print(f"counters {program.counters}")
+
+    # uniform snapshots: copied from the uniform store instead of read back from the driver
+    def _legacy_uniform_context(program: Program):
+        uniforms = [(elem.name, elem.value) for elem in [program.program.get(k, None) for k in program.program] if isinstance(elem, mgl.Uniform)]
+        for name, value in uniforms:
+            program.set(name, value)
+
+    def _uniform_context(program: Program):
+        with UniformContext(program):
+            pass
+
+    for name, snapshot in (("legacy", lambda: _legacy_uniform_context(program)), ("store", lambda: _uniform_context(program))):
+        start = time.perf_counter()
+        for _ in range(swaps * 100):
+            snapshot()
+        print(f"{name:>6}  snapshot | mean {(time.perf_counter() - start) / (swaps * 100) * 1e6:8.2f} us")
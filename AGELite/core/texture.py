@@ -1,10 +1,20 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
 from pathlib import Path
 import enum
+import mmap
+import os
+import struct
 
 import PIL.Image as Image
 import moderngl as mgl
+import numpy as np
 import glm
+from imgui_bundle import imgui
+
+from .cache import CACHE, file_hash, key_hash, touch, evict_lru, write_atomic
 
 if TYPE_CHECKING: 
     from scene import Scene
@@ -21,6 +31,10 @@ class TEXTURE:
         NORMAL = 5
         EMMISIVE = 6
         AO = 7
+        ORM = 8 # packed occlusion/roughness/metallic
+        MATERIAL = 9 # texture array of every 2D map (see MaterialArray)
+        CLUSTERS = 10      # light clusters grid (see LightClusters)
+        LIGHT_INDICES = 11 # light indices of the clusters
 
     class FLAGS(enum.IntFlag):
         CUBEMAP = 1
@@ -31,6 +45,12 @@ class TEXTURE:
         NORMAL = 32
         EMMISIVE = 64
         AO = 128
+        ORM = 256
+
+    class MIPMAPS(enum.Enum):
+        NONE = 0 # no mip levels (min filter falls back to its non-mipmapped version)
+        GPU = 1  # build_mipmaps() after upload
+        CPU = 2  # mip chain precomputed at decode time and stored in the texture cache
 
     LOCATION_BY_NAME = {
         "cubemap"  : LOCATION.CUBEMAP,
@@ -40,7 +60,8 @@ class TEXTURE:
         "roughness": LOCATION.ROUGHNESS,
         "normal"   : LOCATION.NORMAL,
         "emmision" : LOCATION.EMMISIVE,
-        "ao"       : LOCATION.AO
+        "ao"       : LOCATION.AO,
+        "orm"      : LOCATION.ORM
     }
 
     FLAG_BY_NAME = {
@@ -51,18 +72,63 @@ class TEXTURE:
         "roughness": FLAGS.ROUGHNESS,
         "normal"   : FLAGS.NORMAL,
         "emmision" : FLAGS.EMMISIVE,
-        "ao"       : FLAGS.AO
+        "ao"       : FLAGS.AO,
+        "orm"      : FLAGS.ORM
     }
 
     FLAG_ENABLED = 0 # flags
 
+    # material maps can be stored as the layers of one texture array bound once, instead of one texture unit and sampler per map (see MaterialArray)
+    MATERIAL_ARRAY = False # the scene program must then be built with MATERIAL_ARRAY_DEFINES
+    MATERIAL_ARRAY_DEFINES = {"MATERIAL_ARRAY": "1"}
+    ARRAY_LAYER_BY_NAME = { # must match the LAYER_ constants of common/uio.frag
+        "albedo"   : 0,
+        "metallic" : 1,
+        "specular" : 2,
+        "roughness": 3,
+        "normal"   : 4,
+        "emmision" : 5,
+        "ao"       : 6,
+        "orm"      : 7
+    }
+
     CUBEMAP_FACES = ["right", "left", "top", "bottom", "back", "front"]
+    CUBEMAP_FACE_TRANSPOSE = {face: Image.Transpose.FLIP_TOP_BOTTOM if face in ["top", "bottom"] else Image.Transpose.FLIP_LEFT_RIGHT for face in CUBEMAP_FACES}
+
+    DECODE_WORKERS = min(6, os.cpu_count() or 1) # background threads decoding image files (see Texture.decode_async), 6 decodes a whole cubemap at once
+
+    # decoded textures are cached in CACHE.TEXTURE_FOLDER as a header + the raw bytes ready for upload
+    USE_CACHE = True
+    CACHE_VERSION = 1 # bump when the decoded output changes (invalidates the texture cache)
+    CACHE_HEADER = struct.Struct("<8s5I") # magic, version, width, height, components, levels
+    CACHE_MAGIC = b"AGETEX\0\0"
+
+    # default sampling of textures created from files, can be overridden per texture (see Texture.set_sampling)
+    MIPMAP_MODE = MIPMAPS.GPU
+    MIN_FILTER = mgl.LINEAR_MIPMAP_LINEAR
+    MAG_FILTER = mgl.LINEAR
+    ANISOTROPY = 8.0 # clamped to ctx.max_anisotropy, 1.0 disables it
+
+    # least recently used textures that can be reloaded are evicted above this amount of texture memory (see TextureRegistry)
+    VRAM_BUDGET = 512 * 1024 * 1024
+
+    _NON_MIPMAPPED_FILTER = {
+        mgl.NEAREST_MIPMAP_NEAREST: mgl.NEAREST,
+        mgl.NEAREST_MIPMAP_LINEAR : mgl.NEAREST,
+        mgl.LINEAR_MIPMAP_NEAREST : mgl.LINEAR,
+        mgl.LINEAR_MIPMAP_LINEAR  : mgl.LINEAR,
+    }
 
     @staticmethod
     def enableTexture(scene: 'Scene', key: str, texture: 'Texture'):
         """ Enable a texture in the shader """
         TEXTURE.FLAG_ENABLED |= TEXTURE.FLAG_BY_NAME[key].value
-        scene.program.set("enabled_maps", TEXTURE.FLAG_ENABLED)
+        scene.program.set_variant("enabled_maps", TEXTURE.FLAG_ENABLED)
+
+        if isinstance(texture, MaterialArray): # the map is a layer of the array: same unit and sampler for every map
+            texture.use(TEXTURE.LOCATION.MATERIAL.value)
+            scene.program.set("map_material", TEXTURE.LOCATION.MATERIAL.value)
+            return
 
         _LID = TEXTURE.LOCATION_BY_NAME[key]
         texture.use(_LID.value)
@@ -72,29 +138,32 @@ class TEXTURE:
     def disableTexture(scene: 'Scene', key: str):
         """ Disable a texture in the shader """
         TEXTURE.FLAG_ENABLED &= ~TEXTURE.FLAG_BY_NAME[key].value
-        scene.program.set("enabled_maps", TEXTURE.FLAG_ENABLED)
+        scene.program.set_variant("enabled_maps", TEXTURE.FLAG_ENABLED)
+        TextureRegistry.unbind(TEXTURE.LOCATION_BY_NAME[key].value) # not sampled anymore: can be evicted
+
 
+# decoded image ready for upload: (size, bytes of all levels, number of levels, number of components)
+DecodedImage = tuple[tuple[int, int], bytes | memoryview, int, int]
 
 class Texture:
     """ Texture class """
+    _decoder: ThreadPoolExecutor | None = None
+
     @classmethod
     def cube_map(cls, ctx: mgl.Context, dir_path: Path):
         """ Create a cubemap from a directory of images 
         names should be "right", "left", "top", "bottom", "back", "front" """
-        textures: list[Image.Image] = []
+        # the six faces are decoded concurrently, then uploaded in one pass once all of them are ready
+        faces = [Texture._decoder_pool().submit(Texture.decode, dir_path.joinpath(face).with_suffix(".png"), TEXTURE.CUBEMAP_FACE_TRANSPOSE[face]) for face in TEXTURE.CUBEMAP_FACES]
+        faces: list[DecodedImage] = [face.result() for face in faces]
 
-        for face in TEXTURE.CUBEMAP_FACES:
-            path = dir_path.joinpath(face).with_suffix(".png")
-            img = Image.open(path).convert('RGBA')
-            if face in ["top", "bottom"]:
-                img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-            else:
-                img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-            textures.append(img)
+        size = faces[0][0]
+        if any(face_size != size for face_size, _, _, _ in faces):
+            raise ValueError(f"cubemap faces in {dir_path} don't have the same size: {[face_size for face_size, _, _, _ in faces]}")
 
-        texture_cube = ctx.texture_cube(textures[0].size, components=4)
-        for i, img in enumerate(textures):
-            texture_cube.write(face=i, data=img.tobytes())
+        texture_cube = ctx.texture_cube(size, components=4)
+        for i, (_, data, _, _) in enumerate(faces):
+            texture_cube.write(face=i, data=memoryview(data)[:size[0] * size[1] * 4]) # decoded bytes are uploaded as-is, no intermediate copy
 
         return cls(ctx, texture_cube)
     
@@ -107,22 +176,559 @@ class Texture:
         return cls(ctx, texture)
         
     @classmethod
-    def from_file(cls, ctx: mgl.Context, path: Path):
-        """ Create a texture from a file """
-        img = Image.open(path).convert('RGBA')
-        img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-        texture = ctx.texture(img.size, components=4, data=img.tobytes())
+    def from_file(cls, ctx: mgl.Context, path: Path, mipmap_mode: 'TEXTURE.MIPMAPS | None'=None, filter: tuple[int, int] | None=None, anisotropy: float | None=None):
+        """ Create a texture from a file (None options use the TEXTURE defaults) """
+        mipmap_mode = TEXTURE.MIPMAP_MODE if mipmap_mode is None else mipmap_mode
+        source = lambda: Texture.decode(path, mipmaps=mipmap_mode == TEXTURE.MIPMAPS.CPU)
+        return cls.from_decoded(ctx, source(), mipmap_mode, filter, anisotropy, source)
 
-        return cls(ctx, texture)
+    @classmethod
+    def from_decoded(cls, ctx: mgl.Context, decoded: DecodedImage, mipmap_mode: 'TEXTURE.MIPMAPS | None'=None, filter: tuple[int, int] | None=None, anisotropy: float | None=None, source: Callable[[], DecodedImage] | None=None):
+        """ Create a texture from a decoded image (only the upload, must be called from the GL thread) 
+        a decoded mip chain is always uploaded, else mip levels are built on the GPU unless mipmap_mode is TEXTURE.MIPMAPS.NONE 
+        source decodes the image again (ie. from the texture cache): the texture can then be evicted by TextureRegistry and is reloaded on use """
+        mipmap_mode = TEXTURE.MIPMAP_MODE if mipmap_mode is None else mipmap_mode
+        texture, mipmapped = Texture._upload(ctx, decoded, mipmap_mode)
+
+        result = cls(ctx, texture, source, mipmapped)
+        result.mipmap_mode = mipmap_mode
+        result.set_sampling(filter, anisotropy)
+        return result
+
+    @staticmethod
+    def _upload(ctx: mgl.Context, decoded: DecodedImage, mipmap_mode: 'TEXTURE.MIPMAPS') -> tuple[mgl.Texture, bool]:
+        """ upload a decoded image and its mip levels, returns (texture, mipmapped) """
+        size, data, levels, components = decoded
+        data = memoryview(data)
+        mip_sizes = Texture.mip_sizes(size, levels)
+
+        texture = ctx.texture(size, components=components, data=data[:size[0] * size[1] * components])
+        if components == 1:
+            texture.swizzle = 'RRR1' # single channel maps read as grey, like the RGBA version did
+        if levels > 1:
+            # moderngl can't allocate empty mip levels: let the driver build them, then overwrite them with the decoded chain
+            texture.build_mipmaps(0, levels - 1)
+            offset = size[0] * size[1] * components
+            for level, (width, height) in enumerate(mip_sizes[1:], 1):
+                texture.write(data[offset:offset + width * height * components], level=level)
+                offset += width * height * components
+        elif mipmap_mode != TEXTURE.MIPMAPS.NONE:
+            texture.build_mipmaps()
+
+        return texture, levels > 1 or mipmap_mode != TEXTURE.MIPMAPS.NONE
+
+    @staticmethod
+    def mip_sizes(size: tuple[int, int], levels: int | None=None) -> list[tuple[int, int]]:
+        """ sizes of the mip levels of a texture, the full chain (down to 1x1) if levels is None """
+        width, height = size
+        sizes = [(width, height)]
+        while (levels is None and (width > 1 or height > 1)) or (levels is not None and len(sizes) < levels):
+            width, height = max(1, width // 2), max(1, height // 2)
+            sizes.append((width, height))
+        return sizes
+
+    @staticmethod
+    def decode(path: Path, transpose: Image.Transpose = Image.Transpose.FLIP_TOP_BOTTOM, mipmaps: bool=False, components: int=4) -> DecodedImage:
+        """ Decode an image file to flipped RGBA (components=4) or red channel (components=1) bytes, and its mip chain if mipmaps. 
+        Doesn't touch the GL context, safe to call from any thread """
+        assert components in (1, 4), "components must be 1 (red channel) or 4 (RGBA)"
+
+        def decode_file() -> DecodedImage:
+            with Image.open(path) as img:
+                img = Texture._to_channels(img, components)
+                img = img.transpose(transpose)
+                return img.size, img.tobytes(), 1, components
 
-    def __init__(self, ctx: mgl.Context, texture: mgl.Texture):
+        # cache entries are keyed on the file content and the decode options
+        return Texture._decode_cached(Path(path).stem, (file_hash(path), transpose.name, components), decode_file, mipmaps)
+
+    @staticmethod
+    def decode_orm(ao: Path | None, roughness: Path | None, metallic: Path | None, transpose: Image.Transpose = Image.Transpose.FLIP_TOP_BOTTOM, mipmaps: bool=False) -> DecodedImage:
+        """ Decode and pack three single channel maps into one RGB image: occlusion (r), roughness (g), metallic (b). 
+        A missing map is filled with its neutral value (no occlusion, fully rough, not metallic) """
+        channels = {"ao": (ao, 255), "roughness": (roughness, 255), "metallic": (metallic, 0)}
+        if all(path is None for path, _ in channels.values()):
+            raise ValueError("decode_orm needs at least one map")
+
+        def decode_files() -> DecodedImage:
+            planes = {}
+            for name, (path, _) in channels.items():
+                if path is not None:
+                    with Image.open(path) as img:
+                        planes[name] = np.asarray(Texture._to_channels(img, 1).transpose(transpose))
+
+            shapes = {plane.shape for plane in planes.values()}
+            if len(shapes) != 1:
+                raise ValueError(f"orm maps don't have the same size: { {name: plane.shape[::-1] for name, plane in planes.items()} }")
+            height, width = shapes.pop()
+
+            packed = np.empty((height, width, 3), dtype='u1')
+            for i, (name, (_, default)) in enumerate(channels.items()):
+                packed[:, :, i] = planes[name] if name in planes else default
+            return (width, height), packed.tobytes(), 1, 3
+
+        stem = next(Path(path).stem for path, _ in channels.values() if path is not None)
+        key = tuple(file_hash(path) if path is not None else default for path, default in channels.values())
+        return Texture._decode_cached(f"{stem}-orm", (*key, transpose.name, "orm"), decode_files, mipmaps)
+
+    @staticmethod
+    def decode_async(path: Path, mipmaps: bool | None=None, components: int=4) -> Future:
+        """ Decode an image file in the background (PIL releases the GIL while decoding), the future result is passed to Texture.from_decoded 
+        the mip chain is decoded too if mipmaps, or if None and TEXTURE.MIPMAP_MODE is TEXTURE.MIPMAPS.CPU """
+        mipmaps = TEXTURE.MIPMAP_MODE == TEXTURE.MIPMAPS.CPU if mipmaps is None else mipmaps
+        return Texture.submit(partial(Texture.decode, path, mipmaps=mipmaps, components=components))
+
+    @staticmethod
+    def decode_orm_async(ao: Path | None, roughness: Path | None, metallic: Path | None, mipmaps: bool | None=None) -> Future:
+        """ Texture.decode_orm in the background, see Texture.decode_async """
+        mipmaps = TEXTURE.MIPMAP_MODE == TEXTURE.MIPMAPS.CPU if mipmaps is None else mipmaps
+        return Texture.submit(partial(Texture.decode_orm, ao, roughness, metallic, mipmaps=mipmaps))
+
+    @staticmethod
+    def submit(decode: Callable[[], DecodedImage]) -> Future:
+        """ run a decode function (ie. a texture source) on the background decoding threads """
+        return Texture._decoder_pool().submit(decode)
+
+    @staticmethod
+    def _to_channels(img: Image.Image, components: int) -> Image.Image:
+        """ RGBA image (components=4) or its red channel (components=1), copying only if needed """
+        if components == 4:
+            return img if img.mode == 'RGBA' else img.convert('RGBA') # convert() copies even if the mode already matches
+        if img.mode == 'L':
+            return img
+        if img.mode in ('RGB', 'RGBA', 'LA'):
+            return img.getchannel(0) # shaders only ever read the red channel of these maps
+        return img.convert('L')
+
+    @staticmethod
+    def _decode_cached(stem: str, key: tuple, decode: Callable[[], DecodedImage], mipmaps: bool) -> DecodedImage:
+        """ load a decoded image from the texture cache, else decode it (and its mip chain) and cache it """
+        entry = None
+        if TEXTURE.USE_CACHE:
+            entry = CACHE.TEXTURE_FOLDER.joinpath(f"{stem}-{key_hash(*key, mipmaps, TEXTURE.CACHE_VERSION)}.tex")
+            if (decoded := Texture._load_cached(entry)) is not None:
+                return decoded
+
+        decoded = decode()
+        if mipmaps:
+            decoded = Texture._build_mip_chain(decoded)
+
+        if entry is not None:
+            Texture._write_cached(entry, decoded)
+
+        return decoded
+
+    @staticmethod
+    def _build_mip_chain(decoded: DecodedImage) -> DecodedImage:
+        """ append the mip chain to a decoded image (2x2 box filter, odd rows/columns are dropped) """
+        size, data, _, components = decoded
+        image = np.frombuffer(data, dtype='u1').reshape(size[1], size[0], components)
+        chain = [image]
+        for width, height in Texture.mip_sizes(size)[1:]:
+            src = image.astype('u2')
+            src = src[0:height * 2:2] + src[1:height * 2:2] if image.shape[0] > 1 else src * 2
+            src = src[:, 0:width * 2:2] + src[:, 1:width * 2:2] if image.shape[1] > 1 else src * 2
+            image = ((src + 2) >> 2).astype('u1')
+            chain.append(image)
+        return size, b"".join(level.tobytes() for level in chain), len(chain), components
+
+    @staticmethod
+    def _load_cached(entry: Path) -> DecodedImage | None:
+        """ map a cached decoded texture, None if missing or invalid """
+        try:
+            with open(entry, "rb") as file:
+                payload = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(payload) < TEXTURE.CACHE_HEADER.size:
+            return None
+        magic, version, width, height, components, levels = TEXTURE.CACHE_HEADER.unpack_from(payload)
+        expected = sum(w * h * components for w, h in Texture.mip_sizes((width, height), levels))
+        if magic != TEXTURE.CACHE_MAGIC or version != TEXTURE.CACHE_VERSION or components not in (1, 3, 4) or len(payload) != TEXTURE.CACHE_HEADER.size + expected:
+            return None
+
+        touch(entry)
+        return (width, height), memoryview(payload)[TEXTURE.CACHE_HEADER.size:], levels, components # the mapping stays open while the view is alive
+
+    @staticmethod
+    def _write_cached(entry: Path, decoded: DecodedImage) -> None:
+        """ write a decoded texture to the cache, evicting the least recently used entries above CACHE.TEXTURE_MAX_BYTES """
+        (width, height), data, levels, components = decoded
+        def write(file):
+            file.write(TEXTURE.CACHE_HEADER.pack(TEXTURE.CACHE_MAGIC, TEXTURE.CACHE_VERSION, width, height, components, levels))
+            file.write(data)
+        try:
+            write_atomic(entry, write)
+            evict_lru(CACHE.TEXTURE_FOLDER, CACHE.TEXTURE_MAX_BYTES, "*.tex")
+        except OSError as e:
+            print(f"\x1b[33mCan't write texture cache for {entry.name}: {e}\x1b[0m")
+
+    @staticmethod
+    def _decoder_pool() -> ThreadPoolExecutor:
+        """ shared thread pool for image decoding, created on first use """
+        if Texture._decoder is None:
+            Texture._decoder = ThreadPoolExecutor(max_workers=TEXTURE.DECODE_WORKERS, thread_name_prefix="texture_decode")
+        return Texture._decoder
+
+    def __init__(self, ctx: mgl.Context, texture: mgl.Texture, source: Callable[[], DecodedImage] | None=None, mipmapped: bool=False):
         self.ctx = ctx
-        self.texture = texture
+        self.texture = texture # None while evicted
+        self.source = source
+        self.mipmapped = mipmapped
+        self.mipmap_mode = TEXTURE.MIPMAPS.NONE
+        self.filter: tuple[int, int] | None = None
+        self.anisotropy: float | None = None
+
+        self.nbytes = Texture.gpu_bytes(texture, mipmapped)
+        TextureRegistry.register(self)
+
+    @staticmethod
+    def gpu_bytes(texture: mgl.Texture | mgl.TextureCube, mipmapped: bool=False) -> int:
+        """ estimated memory of a texture: every level of every face (or layer), at the size of its components """
+        faces = 6 if isinstance(texture, mgl.TextureCube) else texture.size[2] if isinstance(texture, mgl.TextureArray) else 1
+        texel = texture.components * int(texture.dtype[1:])
+        size = texture.size[:2]
+        levels = Texture.mip_sizes(size) if mipmapped else [size]
+        return faces * texel * sum(width * height for width, height in levels)
+
+    @property
+    def resident(self) -> bool:
+        """ False if the texture was evicted from the GPU by TextureRegistry """
+        return self.texture is not None
+
+    def release(self):
+        """ Release the GPU texture, the Texture can't be used anymore """
+        TextureRegistry.unregister(self)
+        if self.texture is not None:
+            self.texture.release()
+            self.texture = None
+        self.source = None
+
+    def _evict(self):
+        """ release the GPU texture but keep the way to reload it (called by TextureRegistry) """
+        self.texture.release()
+        self.texture = None
+
+    def _reload(self):
+        """ upload the texture again from its source (called by TextureRegistry) """
+        self.texture, self.mipmapped = Texture._upload(self.ctx, self.source(), self.mipmap_mode)
+        self.set_sampling(self.filter, self.anisotropy)
+
+    def set_sampling(self, filter: tuple[int, int] | None=None, anisotropy: float | None=None):
+        """ Set the (min, mag) filter and the anisotropy of the texture (None uses the TEXTURE defaults) """
+        self.filter, self.anisotropy = filter, anisotropy # kept to restore them after a reload
+        min_filter, mag_filter = (TEXTURE.MIN_FILTER, TEXTURE.MAG_FILTER) if filter is None else filter
+        if not self.mipmapped: # sampling missing mip levels would give an incomplete (black) texture
+            min_filter = TEXTURE._NON_MIPMAPPED_FILTER.get(min_filter, min_filter)
+        self.texture.filter = (min_filter, mag_filter)
+
+        anisotropy = TEXTURE.ANISOTROPY if anisotropy is None else anisotropy
+        self.texture.anisotropy = max(1.0, min(anisotropy, self.ctx.max_anisotropy))
         
     
     def use(self, location: int = 0):
-        """ Use the texture in the shader """
+        """ Use the texture in the shader (reloaded first if it was evicted) """
         if isinstance(location, enum.Enum):
             location = location.value
+        TextureRegistry.use(self, location)
         self.texture.use(location=location)
-    
\ No newline at end of file
+
+
+class MaterialArray(Texture):
+    """ The 2D maps of a material stored as the RGBA layers of one texture array (layer per map: TEXTURE.ARRAY_LAYER_BY_NAME). 
+    The whole material is bound once on TEXTURE.LOCATION.MATERIAL and sampled from map_material when the program is built with TEXTURE.MATERIAL_ARRAY_DEFINES. 
+    Single channel and packed maps are expanded to RGBA, maps of another size are resized to the array size. 
+    Only the first decoded level is used, mip levels are built on the GPU. The array has no source: it is never evicted by TextureRegistry """
+
+    def __init__(self, ctx: mgl.Context, size: tuple[int, int], mipmap_mode: 'TEXTURE.MIPMAPS | None'=None, filter: tuple[int, int] | None=None, anisotropy: float | None=None):
+        mipmap_mode = TEXTURE.MIPMAP_MODE if mipmap_mode is None else mipmap_mode
+        mipmapped = mipmap_mode != TEXTURE.MIPMAPS.NONE
+        texture = ctx.texture_array((*size, len(TEXTURE.ARRAY_LAYER_BY_NAME)), components=4)
+        if mipmapped:
+            texture.build_mipmaps() # allocates the levels, rebuilt once layers are written
+        super().__init__(ctx, texture, mipmapped=mipmapped)
+
+        self.size = tuple(size)
+        self.layers: set[str] = set() # names of the maps written in the array
+        self.mipmap_mode = mipmap_mode
+        self._dirty = False # mip levels are outdated
+        self.set_sampling(filter, anisotropy)
+
+    def set_layer(self, key: str, decoded: DecodedImage):
+        """ Write a decoded map in its layer (must be called from the GL thread) """
+        layer = TEXTURE.ARRAY_LAYER_BY_NAME[key]
+        self.texture.write(MaterialArray.to_layer(decoded, self.size), viewport=(0, 0, layer, *self.size, 1))
+        self.layers.add(key)
+        self._dirty = self.mipmapped
+
+    def clear_layer(self, key: str):
+        """ Forget a map, its layer is kept as-is until overwritten (its flag disables it in the shader) """
+        self.layers.discard(key)
+
+    @staticmethod
+    def to_layer(decoded: DecodedImage, size: tuple[int, int]) -> bytes:
+        """ RGBA bytes of the first level of a decoded image, resized to size if needed """
+        (width, height), data, _, components = decoded
+        pixels = np.frombuffer(data, dtype='u1', count=width * height * components).reshape(height, width, components)
+        if components != 4:
+            rgba = np.full((height, width, 4), 255, dtype='u1')
+            rgba[:, :, :3] = pixels[:, :, :3] # a single channel is read as grey, like the 'RRR1' swizzle of Texture._upload
+            pixels = rgba
+        if (width, height) != tuple(size):
+            pixels = np.asarray(Image.fromarray(pixels, 'RGBA').resize(size, Image.Resampling.BILINEAR))
+        return pixels.tobytes()
+
+    def use(self, location: int = TEXTURE.LOCATION.MATERIAL.value):
+        """ Use the array in the shader, rebuilding its mip levels first if layers changed """
+        if self._dirty:
+            self.texture.build_mipmaps()
+            self._dirty = False
+        super().use(location)
+
+
+class TextureRegistry:
+    """ Static registry of the living textures: tracks their GPU memory and keeps it under TEXTURE.VRAM_BUDGET 
+    by evicting the least recently used textures that have a source and are not bound to a texture unit. 
+    A texture is bound from its use until another texture is used on its unit, its unit is unbound (ie. TEXTURE.disableTexture) or it is released.
+    An evicted texture is reloaded from its source (the texture cache) the next time it is used. """
+    def __init__(self):
+        raise NotImplementedError("Cannot instantiate static class TextureRegistry")
+
+    textures: OrderedDict[Texture, None] = OrderedDict() # least recently used first
+    bound: dict[int, Texture] = {}                       # texture unit -> texture sampled from it (pinned)
+
+    resident_bytes = 0
+    hits = 0
+    reloads = 0
+    evictions = 0
+
+    @staticmethod
+    def register(texture: Texture):
+        """ track a new texture (called by Texture.__init__) 
+        the texture is still being built (ie. its sampling isn't set yet): other textures are evicted to make room, never this one """
+        TextureRegistry.textures[texture] = None
+        TextureRegistry.resident_bytes += texture.nbytes
+        TextureRegistry._enforce_budget(keep=texture)
+
+    @staticmethod
+    def unregister(texture: Texture):
+        """ stop tracking a released texture """
+        if texture not in TextureRegistry.textures:
+            return
+        del TextureRegistry.textures[texture]
+        if texture.resident:
+            TextureRegistry.resident_bytes -= texture.nbytes
+        for location in [location for location, bound in TextureRegistry.bound.items() if bound is texture]:
+            del TextureRegistry.bound[location]
+
+    @staticmethod
+    def use(texture: Texture, location: int):
+        """ mark a texture as used on a texture unit, reloading it if it was evicted """
+        if texture not in TextureRegistry.textures:
+            raise ValueError("can't use a released texture")
+
+        TextureRegistry.textures.move_to_end(texture)
+        TextureRegistry.bound[location] = texture
+        if texture.resident:
+            TextureRegistry.hits += 1
+            TextureRegistry._enforce_budget() # TEXTURE.VRAM_BUDGET may have been lowered, or textures unbound
+            return
+
+        texture._reload()
+        TextureRegistry.reloads += 1
+        TextureRegistry.resident_bytes += texture.nbytes
+        TextureRegistry._enforce_budget()
+
+    @staticmethod
+    def unbind(location: int):
+        """ the texture of a texture unit isn't sampled anymore, it can be evicted """
+        TextureRegistry.bound.pop(location, None)
+
+    @staticmethod
+    def set_budget(budget_bytes: int):
+        """ set TEXTURE.VRAM_BUDGET and evict textures above it right away """
+        TEXTURE.VRAM_BUDGET = budget_bytes
+        TextureRegistry._enforce_budget()
+
+    @staticmethod
+    def _enforce_budget(keep: Texture | None=None):
+        """ evict least recently used textures until the resident memory fits in the budget (keep is never evicted) """
+        if TextureRegistry.resident_bytes <= TEXTURE.VRAM_BUDGET:
+            return
+        pinned = set(TextureRegistry.bound.values())
+        pinned.add(keep)
+        for texture in list(TextureRegistry.textures):
+            if TextureRegistry.resident_bytes <= TEXTURE.VRAM_BUDGET:
+                break
+            if not texture.resident or texture.source is None or texture in pinned:
+                continue
+            texture._evict()
+            TextureRegistry.resident_bytes -= texture.nbytes
+            TextureRegistry.evictions += 1
+
+    @staticmethod
+    def stats() -> dict[str, int]:
+        """ live statistics of the registry """
+        return {
+            "textures": len(TextureRegistry.textures),
+            "resident": sum(texture.resident for texture in TextureRegistry.textures),
+            "resident_bytes": TextureRegistry.resident_bytes,
+            "budget_bytes": TEXTURE.VRAM_BUDGET,
+            "hits": TextureRegistry.hits,
+            "reloads": TextureRegistry.reloads,
+            "evictions": TextureRegistry.evictions
+        }
+
+    @staticmethod
+    def ui():
+        """ Show the texture memory statistics """
+        stats = TextureRegistry.stats()
+        imgui.separator_text("Textures")
+        imgui.progress_bar(min(1.0, stats["resident_bytes"] / max(1, stats["budget_bytes"])), (-1, 0), f"{stats['resident_bytes'] / 2**20:.1f} / {stats['budget_bytes'] / 2**20:.0f} MB")
+        imgui.text(f"Resident : {stats['resident']}/{stats['textures']} | Hits : {stats['hits']} | Reloads : {stats['reloads']} | Evictions : {stats['evictions']}")
+        changed, budget = imgui.slider_int("VRAM budget (MB)", TEXTURE.VRAM_BUDGET // 2**20, 16, 4096)
+        if changed:
+            TextureRegistry.set_budget(budget * 2**20)
+    
+
+if __name__ == "__main__":
+    # benchmarks (run from the project root):
+    #   python -m AGELite.core.texture cubemap [cubemap folder]    cubemap loading time
+    #   python -m AGELite.core.texture sampling [image]            gpu time of a minified textured floor for each mipmap/filter/anisotropy setting
+    #   python -m AGELite.core.texture budget                      checks the eviction of unbound textures above TEXTURE.VRAM_BUDGET
+    import sys
+    import time
+
+    def _legacy_cube_map(ctx: mgl.Context, dir_path: Path) -> mgl.TextureCube:
+        """ sequential decode and upload, as cube_map used to do """
+        textures: list[Image.Image] = []
+        for face in TEXTURE.CUBEMAP_FACES:
+            img = Image.open(dir_path.joinpath(face).with_suffix(".png")).convert('RGBA').transpose(TEXTURE.CUBEMAP_FACE_TRANSPOSE[face])
+            textures.append(img)
+        texture_cube = ctx.texture_cube(textures[0].size, components=4)
+        for i, img in enumerate(textures):
+            texture_cube.write(face=i, data=img.tobytes())
+        return texture_cube
+
+    def bench_cubemap(ctx: mgl.Context, dir_path: Path):
+        """ cubemap loading benchmark """
+        Texture._decoder_pool() # don't count the pool creation
+
+        def bench(name: str, load: Callable[[], 'mgl.TextureCube | Texture'], repeat: int=5) -> bytes:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                texture_cube = load()
+                ctx.finish()
+                timings.append(time.perf_counter() - start)
+                data = (texture_cube.texture if isinstance(texture_cube, Texture) else texture_cube).read(face=0)
+                texture_cube.release()
+            print(f"{name:>10} | best {min(timings)*1e3:8.2f} ms | mean {sum(timings)/repeat*1e3:8.2f} ms")
+            return data
+
+        print(f"{dir_path} | {TEXTURE.DECODE_WORKERS} decode workers")
+        legacy = bench("legacy", lambda: _legacy_cube_map(ctx, dir_path))
+        TEXTURE.USE_CACHE = False
+        parallel = bench("parallel", lambda: Texture.cube_map(ctx, dir_path))
+        TEXTURE.USE_CACHE = True
+        cached = bench("cached", lambda: Texture.cube_map(ctx, dir_path)) # first run fills the cache
+        assert legacy == parallel == cached, "cubemap content differs"
+
+    def bench_sampling(ctx: mgl.Context, path: Path, size: tuple[int, int]=(1024, 512), draws: int=10):
+        """ sampling benchmark: a textured floor going to the horizon, mostly minified and viewed at grazing angles """
+        program = ctx.program(
+            vertex_shader="""
+                #version 330 core
+                out vec2 uv_screen;
+                void main() {
+                    vec2 vertices[3] = vec2[3](vec2(-1.0, -1.0), vec2(3.0, -1.0), vec2(-1.0, 3.0));
+                    uv_screen = vertices[gl_VertexID];
+                    gl_Position = vec4(vertices[gl_VertexID], 0.0, 1.0);
+                }""",
+            fragment_shader="""
+                #version 330 core
+                uniform sampler2D map;
+                in vec2 uv_screen;
+                out vec4 color;
+                void main() {
+                    float depth = 1.0 / max(1.0 - uv_screen.y, 1e-3); // perspective floor, infinitely far at the top of the screen
+                    color = texture(map, vec2(uv_screen.x * depth, depth) * 4.0);
+                }""")
+        vao = ctx.vertex_array(program, [])
+        fbo = ctx.simple_framebuffer(size)
+        query = ctx.query(time=True)
+
+        TEXTURE.USE_CACHE = True
+        settings = {
+            "no mipmaps"      : (TEXTURE.MIPMAPS.NONE, (mgl.LINEAR, mgl.LINEAR), 1.0),
+            "gpu bilinear"    : (TEXTURE.MIPMAPS.GPU, (mgl.LINEAR_MIPMAP_NEAREST, mgl.LINEAR), 1.0),
+            "gpu trilinear"   : (TEXTURE.MIPMAPS.GPU, (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR), 1.0),
+            "cpu trilinear"   : (TEXTURE.MIPMAPS.CPU, (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR), 1.0),
+            "gpu trilinear x4": (TEXTURE.MIPMAPS.GPU, (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR), 4.0),
+            "gpu trilinear x16": (TEXTURE.MIPMAPS.GPU, (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR), 16.0),
+        }
+
+        print(f"{path} | {size[0]}x{size[1]} | {draws} draws | max anisotropy {ctx.max_anisotropy}")
+        for name, (mipmap_mode, filter, anisotropy) in settings.items():
+            texture = Texture.from_file(ctx, path, mipmap_mode, filter, anisotropy)
+            texture.use(0)
+            fbo.use()
+            vao.render(mgl.TRIANGLES, vertices=3) # warm up
+            ctx.finish()
+
+            start = time.perf_counter()
+            with query:
+                for _ in range(draws):
+                    vao.render(mgl.TRIANGLES, vertices=3)
+            ctx.finish()
+            wall = (time.perf_counter() - start) / draws # software drivers may not implement timer queries
+            print(f"{name:>18} | gpu {query.elapsed / draws / 1e6:8.3f} ms/draw | wall {wall * 1e3:8.3f} ms/draw | {texture.texture.anisotropy:4.1f}x | {'mipmapped' if texture.mipmapped else 'base level only'}")
+            texture.release()
+
+    def check_budget(ctx: mgl.Context, units: int=6, size: int=64):
+        """ textures used on their own unit: only the unbound ones are evicted when the budget is lowered, then reloaded on use """
+        decoded: DecodedImage = ((size, size), bytes(size * size * 4), 1, 4)
+        textures = [Texture.from_decoded(ctx, decoded, TEXTURE.MIPMAPS.NONE, source=lambda: decoded) for _ in range(units)]
+        for location, texture in enumerate(textures):
+            texture.use(location)
+        budget, evictions = TEXTURE.VRAM_BUDGET, TextureRegistry.evictions
+
+        TextureRegistry.set_budget(size * size * 4 * 2) # room for two textures, all of them bound
+        assert TextureRegistry.evictions == evictions and all(texture.resident for texture in textures), "bound textures were evicted"
+
+        for location in range(units - 2): # the two last ones stay bound
+            TextureRegistry.unbind(location)
+        TextureRegistry.set_budget(TEXTURE.VRAM_BUDGET) # same budget, the unbound textures are evicted
+        assert TextureRegistry.evictions - evictions == units - 2, f"{TextureRegistry.evictions - evictions} evictions"
+        assert [texture.resident for texture in textures] == [False] * (units - 2) + [True] * 2
+
+        textures[0].use(0) # reloaded
+        TextureRegistry.unbind(units - 2)
+        TEXTURE.VRAM_BUDGET = size * size * 4 * 2 # set in code: enforced on the next use
+        textures[-1].use(units - 1)
+        assert [texture.resident for texture in textures] == [True] + [False] * (units - 2) + [True], [texture.resident for texture in textures]
+
+        # over budget registration: the new texture is built and sampled, an unbound one is evicted instead
+        TextureRegistry.unbind(0)
+        TextureRegistry.set_budget(size * size * 4) # only textures[-1] (bound) fits
+        created = Texture.from_decoded(ctx, decoded, TEXTURE.MIPMAPS.NONE, (mgl.NEAREST, mgl.NEAREST), source=lambda: decoded)
+        assert created.resident and created.texture.filter == (mgl.NEAREST, mgl.NEAREST) and not textures[0].resident
+        textures.append(created)
+        created = Texture.from_decoded(ctx, decoded, TEXTURE.MIPMAPS.NONE, source=lambda: decoded) # the previous unbound new texture makes room
+        assert created.resident and not textures[-1].resident and textures[-2].resident
+        textures.append(created)
+
+        for texture in textures:
+            texture.release()
+        TextureRegistry.set_budget(budget)
+        print(f"budget | ok | {TextureRegistry.stats()}")
+
+    benchmarks = {"cubemap": (bench_cubemap, "res/Textures/skybox"), "sampling": (bench_sampling, "res/Textures/Kintsugi/Kintsugi_001_basecolor.png"), "budget": (check_budget, None)}
+    ctx = mgl.create_standalone_context()
+    for name in sys.argv[1:2] or benchmarks:
+        benchmark, default_path = benchmarks[name]
+        if default_path is None:
+            benchmark(ctx)
+        else:
+            benchmark(ctx, Path(sys.argv[2] if len(sys.argv) > 2 else default_path))
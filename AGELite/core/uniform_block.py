@@ -0,0 +1,142 @@
+import enum
+
+import moderngl as mgl
+import numpy as np
+
+
+class UNIFORM_BLOCK:
+    """ Uniform block globals """
+
+    class BINDING(enum.Enum):
+        FRAME = 0       # FrameConstants of the scene (common/frame.glsl)
+        LIGHTS = 1      # Lights (common/uio.frag)
+        ARROW_FRAME = 2 # FrameConstants of GUI_Arrow (own camera)
+        POINT_LIGHTS = 3 # PointLights (common/uio.frag)
+
+    # binding point of the blocks declared in the shaders, unless changed with Program.bind_block
+    BINDING_BY_NAME = {
+        "FrameConstants": BINDING.FRAME,
+        "Lights"        : BINDING.LIGHTS,
+        "PointLights"   : BINDING.POINT_LIGHTS
+    }
+
+    # std140 (base alignment, size) of the member types
+    STD140 = {
+        "int"  : (4, 4),
+        "float": (4, 4),
+        "vec2" : (8, 8),
+        "vec3" : (16, 12),
+        "vec4" : (16, 16),
+        "mat4" : (16, 64),
+        "PointLight": (16, 80) # common/common.frag
+    }
+    MERGE_GAP = 64 # changed ranges closer than this (bytes) are uploaded with one write
+
+    # members in declaration order, must match the blocks of the shaders
+    FRAME_MEMBERS = (
+        ("m_proj", "mat4"),
+        ("m_view", "mat4"),
+        ("m_inv_proj_view", "mat4"),
+        ("v3_camera_position", "vec3"),
+        ("f_time", "float"),
+        ("v2_resolution", "vec2"),
+        ("f_near", "float"),
+        ("f_far", "float"),
+    )
+    LIGHTS_MEMBERS = ( # struct members flattened: DirectionalLight and Light start on a vec3/mat4, already aligned to 16 like std140 structs
+        ("directional_light.shadowable", "int"),
+        ("directional_light.m_view_light", "mat4"),
+        ("directional_light.direction", "vec3"),
+        ("directional_light.light.position", "vec3"),
+        ("directional_light.light.Ia", "vec3"),
+        ("directional_light.light.Id", "vec3"),
+        ("directional_light.light.Is", "vec3"),
+    )
+    MAX_POINT_LIGHTS = 200 # must match MAX_POINT_LIGHTS of common/common.frag, the block (16 + 80 * 200 bytes) fits the 16KB guaranteed by GL
+    POINT_LIGHTS_MEMBERS = ( # point_lights is written a light at a time (see PointLight)
+        ("point_light_count", "int"),
+        ("point_lights", f"PointLight[{MAX_POINT_LIGHTS}]"),
+    )
+
+
+class UniformBlock:
+    """
+    std140 uniform block shared by every program declaring it: members are set in a CPU copy,
+    the changed ranges are uploaded once per frame (usually a single buffer write).
+
+    Usage:
+        frame = UniformBlock.create("frame", ctx, UNIFORM_BLOCK.BINDING.FRAME, UNIFORM_BLOCK.FRAME_MEMBERS)
+        frame.set("m_proj", m_proj)
+        ...
+        frame.update() # once per frame, before rendering
+    """
+
+    List: dict[str, 'UniformBlock'] = {}
+
+    @staticmethod
+    def get(name: str) -> 'UniformBlock':
+        """ get uniform block by name """
+        return UniformBlock.List.get(name)
+
+    @staticmethod
+    def create(name: str, ctx: mgl.Context, binding: UNIFORM_BLOCK.BINDING, members: tuple[tuple[str, str], ...]) -> 'UniformBlock':
+        """ create new uniform block """
+        UniformBlock.List[name] = UniformBlock(ctx, binding, members)
+        return UniformBlock.List[name]
+
+    def __init__(self, ctx: mgl.Context, binding: UNIFORM_BLOCK.BINDING, members: tuple[tuple[str, str], ...]):
+        self.members: dict[str, tuple[int, int, type]] = {} # key -> (offset, size, dtype)
+        offset = 0
+        for key, glsl_type in members:
+            glsl_type, _, count = glsl_type.partition("[") # arrays: elements are aligned to a vec4
+            alignment, size = UNIFORM_BLOCK.STD140[glsl_type]
+            if count:
+                alignment, size = 16, -(-size // 16) * 16 * int(count.rstrip("]"))
+            offset = -(-offset // alignment) * alignment
+            self.members[key] = (offset, size, np.int32 if glsl_type == "int" else np.float32)
+            offset += size
+
+        self.data = bytearray(-(-offset // 16) * 16) # block size is rounded up to a vec4
+        self.buffer = ctx.buffer(self.data)
+        self.binding = binding
+        self.buffer.bind_to_uniform_block(binding.value)
+
+        self.changed: list[tuple[int, int]] = [] # [start, end) byte ranges set since the last upload
+        self.uploads = 0 # buffer writes since creation
+        self.uploaded_bytes = 0
+
+    def set(self, key: str, value, offset: int | None=None):
+        """ set a member (glm value, number, sequence or bytes), uploaded on the next update if it changed 
+        with an offset (bytes) only a part of the member is set, ie. one element of an array """
+        member_offset, size, dtype = self.members[key]
+        data = value if isinstance(value, bytes) else np.asarray(value, dtype=dtype).tobytes(order="A") # memory order: glm matrices are column major
+        if (len(data) != size) if offset is None else (offset + len(data) > size):
+            raise ValueError(f"Uniform block member '{key}' is {size} bytes, got {len(data)} at {offset or 0}")
+        start = member_offset + (offset or 0)
+        if self.data[start:start + len(data)] != data:
+            self.data[start:start + len(data)] = data
+            self.changed.append((start, start + len(data)))
+
+    write = set # same calls as Program.write (see Light.update)
+
+    def update(self):
+        """ upload the ranges changed since the last update """
+        if not self.changed:
+            return
+        ranges = sorted(self.changed)
+        start, end = ranges[0]
+        for next_start, next_end in ranges[1:] + [(len(self.data) + UNIFORM_BLOCK.MERGE_GAP + 1,) * 2]:
+            if next_start - end <= UNIFORM_BLOCK.MERGE_GAP: # merged with the current range
+                end = max(end, next_end)
+                continue
+            self.buffer.write(memoryview(self.data)[start:end], offset=start)
+            self.uploads += 1
+            self.uploaded_bytes += end - start
+            start, end = next_start, next_end
+        self.changed = []
+
+    def release(self):
+        self.buffer.release()
+        for name, block in list(UniformBlock.List.items()):
+            if block is self:
+                del UniformBlock.List[name]
@@ -0,0 +1,106 @@
+from pathlib import Path
+import time
+
+import moderngl as mgl
+from imgui_bundle import imgui
+
+from .deferable import Deferable
+from .program import Program
+from ..imgui.logging import UI_Logger as Log
+
+
+class ShaderWatcher(Deferable):
+    """
+    Poll the shader files of the living programs and reload the programs depending on the changed ones.
+
+    Usage:
+        watcher = ShaderWatcher(ctx)
+        ...
+        watcher.update() # each frame, out of imgui drawing
+
+    Files are polled every INTERVAL seconds (modification times only). Changes are batched until no file changed
+    for DEBOUNCE seconds (editors often write a file several times), then changed include files are refreshed in
+    ctx.includes and only the programs using a changed file (directly or through nested includes) are recompiled.
+    """
+
+    INTERVAL = 0.5
+    DEBOUNCE = 0.25
+
+    def __init__(self, ctx: mgl.Context):
+        super().__init__(["reload"])
+        self.ctx = ctx
+        self.enabled = True
+
+        self.mtimes: dict[Path, int] = {} # last seen modification time of every watched file
+        self.changed: set[Path] = set()   # changed files waiting for the debounce delay
+        self.last_poll = 0.0
+        self.last_change = 0.0
+
+        self.last_reload: dict[str, float] = {} # program name -> compile time (ms) of the last reload, inf if it failed
+        self.scan()
+
+    def watched(self) -> set[Path]:
+        """ shader files of every program and every include file """
+        files = {Program.include_path(include_key) for include_key in self.ctx.includes}
+        for program in Program.List.values():
+            files |= {program.vertex_shader_path, program.fragment_shader_path}
+        return files
+
+    def scan(self) -> set[Path]:
+        """ update the modification times of the watched files, returns the files that changed since the last scan """
+        changed = set()
+        for path in self.watched():
+            try:
+                mtime = path.stat().st_mtime_ns
+            except OSError: # missing while being saved: checked again on the next scan
+                continue
+            if path in self.mtimes and self.mtimes[path] != mtime:
+                changed.add(path)
+            self.mtimes[path] = mtime
+        return changed
+
+    def poll(self):
+        """ scan the files if the interval elapsed, and defer a reload once changes settled """
+        now = time.perf_counter()
+        if not self.enabled or now - self.last_poll < ShaderWatcher.INTERVAL:
+            return
+        self.last_poll = now
+
+        if changed := self.scan():
+            self.changed |= changed
+            self.last_change = now
+        elif self.changed and now - self.last_change >= ShaderWatcher.DEBOUNCE:
+            self.reload(self.changed)
+            self.changed = set()
+
+    def update(self):
+        """ poll the files and run the deferred reloads """
+        self.poll()
+        self.run_all()
+
+    @Deferable.defer("reload")
+    def reload(self, changed: set[Path]):
+        """ refresh the changed include files, then recompile the programs depending on a changed file """
+        for include_key in self.ctx.includes:
+            if Program.include_path(include_key) in changed:
+                Program.load_include_file(self.ctx, include_key)
+
+        for name, program in Program.List.items():
+            if program.dependencies().isdisjoint(changed):
+                continue
+            start = time.perf_counter()
+            try:
+                program.reload()
+            except Exception as e:
+                self.last_reload[name] = float("inf")
+                Log.print(f"Can't reload program '{name}' (previous version kept): {e}")
+                continue
+            self.last_reload[name] = (time.perf_counter() - start) * 1e3
+            Log.print(f"Reloaded program '{name}' in {self.last_reload[name]:.1f} ms")
+
+    def ui(self):
+        """ Show the watcher settings and the last reload timings """
+        imgui.separator_text("Shader watcher")
+        _, self.enabled = imgui.checkbox("Reload shaders on change", self.enabled)
+        for name, timing in self.last_reload.items():
+            imgui.text(f"{name} : {'failed' if timing == float('inf') else f'{timing:.1f} ms'}")
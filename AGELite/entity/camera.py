@@ -2,6 +2,7 @@ import glm
 
 from ..imgui.utils.pretty import imgui, UI_GLM_Pretty, UI_Text_Pretty
 from ..core.program import Program
+from ..core.uniform_block import UniformBlock
 
 class CAMERA:
     """ Global camera parameters """
@@ -39,15 +40,20 @@ class Camera:
         self.m_projection = self.get_projection_matrix()
 
 
-    def update(self, program_name: str, shadow_program_name: str=None):
+    def update(self, block_name: str, shadow_program_name: str=None):
+        """ update the camera vectors and write the matrices in the frame constants uniform block """
         if self.camera_mode == Camera.MODE_LOCK:
             self.update_camera_vectors_lock()
         else:
             self.update_camera_vectors_freecam()
 
-        Program.get(program_name).write("v3_camera_position", self.v3_position)
-        Program.get(program_name).write("m_proj", self.m_projection)
-        Program.get(program_name).write("m_view", self.m_view)
+        frame = UniformBlock.get(block_name)
+        frame.set("v3_camera_position", self.v3_position)
+        frame.set("m_proj", self.m_projection)
+        frame.set("m_view", self.m_view)
+        frame.set("m_inv_proj_view", glm.inverse(self.m_projection * self.m_view))
+        frame.set("f_near", self.f_near)
+        frame.set("f_far", self.f_far)
 
         if shadow_program_name is not None and Program.exists(shadow_program_name):
             Program.get(shadow_program_name).write("m_proj", self.m_projection)
@@ -1,9 +1,20 @@
+from typing import TYPE_CHECKING
+from functools import cache
+import struct
+
+import moderngl as mgl
+import numpy as np
 import glm
 
 from ..imgui.utils.pretty import imgui, UI_GLM_Pretty
 from ..imgui.arrow import GUI_Arrow
 from ..imgui.logging import UI_Logger as Log
 from ..core.program import Program
+from ..core.uniform_block import UniformBlock, UNIFORM_BLOCK
+from ..core.texture import TEXTURE
+
+if TYPE_CHECKING:
+    from .camera import Camera
 
 
 class Light:
@@ -20,13 +31,20 @@ class Light:
         self.v3_Id = self.f_diffuse  * self.v3_color
         self.v3_Is = self.f_specular * self.v3_color
 
-    def update(self, program_name: str, uniform_base_name: str):
+    @staticmethod
+    @cache
+    def uniform_keys(uniform_base_name: str) -> tuple[str, str, str]:
+        """ keys of the Ia, Id and Is members of a light uniform (built once per base name) """
+        return f"{uniform_base_name}.Ia", f"{uniform_base_name}.Id", f"{uniform_base_name}.Is"
+
+    def update(self, target: 'Program | UniformBlock', uniform_base_name: str):
+            key_Ia, key_Id, key_Is = Light.uniform_keys(uniform_base_name)
             self.v3_Ia = self.f_ambient * self.v3_color
-            Program.get(program_name).write(f"{uniform_base_name}.Ia", self.v3_Ia)
+            target.write(key_Ia, self.v3_Ia)
             self.v3_Id = self.f_diffuse * self.v3_color
-            Program.get(program_name).write(f"{uniform_base_name}.Id", self.v3_Id)
+            target.write(key_Id, self.v3_Id)
             self.v3_Is = self.f_specular * self.v3_color
-            Program.get(program_name).write(f"{uniform_base_name}.Is", self.v3_Is)
+            target.write(key_Is, self.v3_Is)
 
     
     def ui(self):
@@ -73,14 +91,16 @@ class DirectionalLight(Light):
         self.v3_direction = glm.rotate(self.v3_direction, glm.radians(self.v3_rotation.y), glm.vec3(0, 1, 0))
         self.v3_direction = glm.rotate(self.v3_direction, glm.radians(self.v3_rotation.z), glm.vec3(0, 0, 1))
 
-    def update(self, program_name: str, shadow_program_name: str=None):
-        Light.update(self, program_name, "directional_light.light")
-        Program.get(program_name).set("directional_light.direction", self.v3_direction)
-        #Program.get(program_name).set("directional_light.shadowable", self.b_shadowcaster)
+    def update(self, block_name: str, shadow_program_name: str=None):
+        """ write the light in the lights uniform block """
+        lights = UniformBlock.get(block_name)
+        Light.update(self, lights, "directional_light.light")
+        lights.set("directional_light.direction", self.v3_direction)
+        #lights.set("directional_light.shadowable", self.b_shadowcaster)
 
         if self.b_shadowcaster and shadow_program_name is not None and Program.exists(shadow_program_name):
             self.m_view_light = glm.lookAt(self.v3_position, self.v3_direction, glm.vec3(0, 1, 0))
-            Program.get(program_name).write("directional_light.m_view_light", self.m_view_light)
+            lights.set("directional_light.m_view_light", self.m_view_light)
 
 
     def ui(self):
@@ -123,23 +143,36 @@ class DirectionalLight(Light):
         
 
 class PointLight(Light):
-    """ Point light class """
-    _MAX_POINT_LIGHTS = 3
-    _POINT_LIGHTS = [None] * _MAX_POINT_LIGHTS
+    """ Point light class, packed in the PointLights uniform block (see UNIFORM_BLOCK.POINT_LIGHTS_MEMBERS) """
+    _MAX_POINT_LIGHTS = UNIFORM_BLOCK.MAX_POINT_LIGHTS
+    _POINT_LIGHTS: list['PointLight | None'] = [] # slots, shaders loop over the first point_light_count ones
+
+    # std140 PointLight of common/common.frag: enabled, constant, linear, quadratic, then Light (position, Ia, Id, Is)
+    STD140 = struct.Struct("<i3f" + "3f4x" * 4)
 
     @staticmethod
     def _addPointLight(pointLight: 'PointLight') -> int:
-        for i in range(PointLight._MAX_POINT_LIGHTS):
-            if PointLight._POINT_LIGHTS[i] is None:
+        for i, slot in enumerate(PointLight._POINT_LIGHTS):
+            if slot is None:
                 PointLight._POINT_LIGHTS[i] = pointLight
                 return i
+        if len(PointLight._POINT_LIGHTS) < PointLight._MAX_POINT_LIGHTS:
+            PointLight._POINT_LIGHTS.append(pointLight)
+            return len(PointLight._POINT_LIGHTS) - 1
         return -1
 
+    @staticmethod
+    def _removePointLight(index: int):
+        PointLight._POINT_LIGHTS[index] = None
+        while PointLight._POINT_LIGHTS and PointLight._POINT_LIGHTS[-1] is None: # the count only covers used slots
+            PointLight._POINT_LIGHTS.pop()
+
     def __init__(self, position: glm.vec3=glm.vec3(0, 0, 0), color: glm.vec3=glm.vec3(1, 1, 1), ambient: float=0.06, diffuse: float=0.8, specular: float=1.0, constant: float=1.0, linear: float=0.09, quadratic: float=0.032):
         Light.__init__(self, position, color, ambient, diffuse, specular)
         self.f_constant = constant
         self.f_linear = linear
         self.f_quadratic = quadratic
+        self.b_enabled = False
 
         # do not destroy the point light but do not add it to the renderer
         self.n_index = PointLight._addPointLight(self)
@@ -147,27 +180,34 @@ class PointLight(Light):
             Log.print("Too many point lights; max is %d" % PointLight._MAX_POINT_LIGHTS)
     
 
-    def enable(self, program_name: str):
+    def enable(self, block_name: str):
         if self.n_index == -1:
             self.n_index = PointLight._addPointLight(self)
         if self.n_index == -1:
             Log.print("Too many point lights; max is %d" % PointLight._MAX_POINT_LIGHTS)
             return
         
-        Program.get(program_name).set(f'point_lights[{self.n_index}].enabled', 1)
+        self.b_enabled = True
+        self.update(block_name)
         
-    def disable(self, program_name: str):
-        if self.n_index != -1 and Program.exists(program_name):
-            Program.get(program_name).set(f'point_lights[{self.n_index}].enabled', 0)
-            PointLight._POINT_LIGHTS[self.n_index] = None
+    def disable(self, block_name: str):
+        if self.n_index != -1 and (point_lights := UniformBlock.get(block_name)) is not None:
+            self.b_enabled = False
+            self.update(block_name) # skipped by the shaders until the slot is reused
+            PointLight._removePointLight(self.n_index)
+            point_lights.set("point_light_count", len(PointLight._POINT_LIGHTS))
             self.n_index = -1
 
-    def update(self, program_name: str):
-            Program.get(program_name).write(f'point_lights[{self.n_index}].light.position', self.v3_position)
-            Program.get(program_name).set(f'point_lights[{self.n_index}].constant', self.f_constant)
-            Program.get(program_name).set(f'point_lights[{self.n_index}].linear', self.f_linear)
-            Program.get(program_name).set(f'point_lights[{self.n_index}].quadratic', self.f_quadratic)
-            Light.update(self, program_name, f'point_lights[{self.n_index}].light')
+    def update(self, block_name: str):
+        """ pack the light in its slot of the point lights uniform block (uploaded only if it changed) """
+        if self.n_index == -1:
+            return
+        self.v3_Ia = self.f_ambient  * self.v3_color
+        self.v3_Id = self.f_diffuse  * self.v3_color
+        self.v3_Is = self.f_specular * self.v3_color
+        point_lights = UniformBlock.get(block_name)
+        point_lights.set("point_lights", PointLight.STD140.pack(self.b_enabled, self.f_constant, self.f_linear, self.f_quadratic, *self.v3_position, *self.v3_Ia, *self.v3_Id, *self.v3_Is), offset=self.n_index * PointLight.STD140.size)
+        point_lights.set("point_light_count", len(PointLight._POINT_LIGHTS))
 
     def ui(self):
         Light.ui(self)
@@ -183,4 +223,186 @@ class PointLight(Light):
             self.f_linear = f_linear
 
         if b_update_quadratic: 
-            self.f_quadratic = f_quadratic
\ No newline at end of file
+            self.f_quadratic = f_quadratic
+
+
+class LightClusters:
+    """
+    Clustered forward lighting: the point lights are binned on the CPU (numpy) into a froxel grid of the camera frustum
+    (CLUSTER_X * CLUSTER_Y screen tiles, CLUSTER_Z exponential depth slices), so the shaders only iterate the lights of
+    the fragment cluster (see common/cluster.frag). The programs must be built with LightClusters.DEFINES.
+
+    Usage:
+        clusters = LightClusters(ctx)
+        program.set("map_clusters", TEXTURE.LOCATION.CLUSTERS.value)
+        program.set("map_light_indices", TEXTURE.LOCATION.LIGHT_INDICES.value)
+        ...
+        clusters.update(camera) # each frame, after the point lights
+
+    The radius of a light is the distance where its attenuated intensity falls below CUTOFF.
+    """
+
+    SIZE = (16, 9, 24) # x tiles, y tiles, depth slices
+    INDEX_WIDTH = 1024 # light indices per row of the indices texture (GL 3.3 only guarantees 1024 texels per dimension)
+    CUTOFF = 1.0 / 256.0
+
+    DEFINES = {"CLUSTERED_LIGHTS": "1", "CLUSTER_X": str(SIZE[0]), "CLUSTER_Y": str(SIZE[1]), "CLUSTER_Z": str(SIZE[2]), "CLUSTER_INDEX_WIDTH": str(INDEX_WIDTH)}
+
+    @staticmethod
+    def radii(intensity: np.ndarray, constant: np.ndarray, linear: np.ndarray, quadratic: np.ndarray, cutoff: float=CUTOFF) -> np.ndarray:
+        """ distance where intensity / (constant + linear * d + quadratic * d^2) reaches cutoff (inf if it never does) """
+        c = constant - intensity / cutoff # quadratic * d^2 + linear * d + c = 0, c <= 0 for lights reaching the cutoff
+        with np.errstate(divide="ignore", invalid="ignore"):
+            root = (-linear + np.sqrt(np.maximum(linear * linear - 4.0 * quadratic * c, 0.0))) / (2.0 * quadratic)
+            radius = np.where(quadratic > 0.0, root, np.where(linear > 0.0, -c / linear, np.inf))
+        return np.where(c >= 0.0, 0.0, radius)
+
+    @staticmethod
+    def bin(centers: np.ndarray, radii: np.ndarray, m_projection: glm.mat4, near: float, far: float, size: tuple[int, int, int]=SIZE) -> tuple[np.ndarray, np.ndarray]:
+        """ froxels overlapped by view space spheres, returns (clusters[z, y, x] = (first index, count), indices)
+        the indices of a cluster are sorted, bounds are conservative (bounding box of the sphere in each slice range) """
+        if not 0.0 < near < far:
+            raise ValueError(f"Light clusters need 0 < near < far, got near={near} far={far}")
+        size_x, size_y, size_z = size
+        radii = np.minimum(radii, 1e30) # unbounded lights cover the whole frustum (inf would give nan tile bounds)
+        depth = -centers[:, 2]
+        near_depth, far_depth = np.maximum(depth - radii, near), depth + radii
+        visible = (far_depth >= near) & (near_depth <= far)
+
+        # depth slices: floor(log(depth / near) / log(far / near) * size_z), as in common/cluster.frag
+        scale = size_z / np.log(far / near)
+        z0 = np.floor(np.log(near_depth / near) * scale)
+        z1 = np.floor(np.log(np.maximum(far_depth, near) / near) * scale)
+
+        # screen tiles: x / depth is extreme at the nearest or farthest depth of the sphere
+        tiles = []
+        for axis, scale_ndc, tile_count in ((0, m_projection[0][0], size_x), (1, m_projection[1][1], size_y)):
+            low, high = centers[:, axis] - radii, centers[:, axis] + radii
+            ndc_low = np.minimum(low / near_depth, low / far_depth) * scale_ndc
+            ndc_high = np.maximum(high / near_depth, high / far_depth) * scale_ndc
+            tiles.append((np.floor((ndc_low + 1.0) * 0.5 * tile_count), np.floor((ndc_high + 1.0) * 0.5 * tile_count)))
+        (x0, x1), (y0, y1) = tiles
+
+        def overlap(first: np.ndarray, last: np.ndarray, count: int) -> np.ndarray:
+            cells = np.arange(count)
+            return (cells >= first[:, None]) & (cells <= last[:, None]) & visible[:, None]
+        mask = overlap(z0, z1, size_z)[:, :, None, None] & overlap(y0, y1, size_y)[:, None, :, None] & overlap(x0, x1, size_x)[:, None, None, :]
+
+        cluster_lights = mask.reshape(len(centers), -1).T # (clusters, lights)
+        counts = cluster_lights.sum(axis=1, dtype=np.uint32)
+        clusters = np.empty((size_z, size_y, size_x, 2), dtype=np.uint32)
+        clusters[..., 0] = (np.cumsum(counts, dtype=np.uint32) - counts).reshape(size_z, size_y, size_x)
+        clusters[..., 1] = counts.reshape(size_z, size_y, size_x)
+        return clusters, np.nonzero(cluster_lights)[1] # nonzero is row major: indices grouped by cluster
+
+    def __init__(self, ctx: mgl.Context, size: tuple[int, int, int]=SIZE):
+        self.ctx = ctx
+        self.size = size
+        self.clusters = ctx.texture3d(size, 2, dtype="u4")
+        self.indices = ctx.texture((LightClusters.INDEX_WIDTH, 1), 1, dtype="u2")
+        for texture in (self.clusters, self.indices):
+            texture.filter = (mgl.NEAREST, mgl.NEAREST)
+
+        self.light_count = 0 # lights binned by the last update
+        self.index_count = 0 # light indices of the last update (sum of the cluster counts)
+        self.uploads = 0 # texture writes since creation, skipped when the clusters didn't change
+        self._uploaded: tuple[bytes, bytes] = (b"", b"")
+
+    def update(self, camera: 'Camera'):
+        """ bin the enabled point lights in the clusters of the camera and bind the textures """
+        lights = [light for light in PointLight._POINT_LIGHTS if light is not None and light.b_enabled]
+        self.light_count = len(lights)
+        if lights:
+            values = np.array([(*light.v3_position, max(*(light.v3_Ia + light.v3_Id + light.v3_Is)), light.f_constant, light.f_linear, light.f_quadratic) for light in lights], dtype=np.float64)
+            centers = (np.c_[values[:, :3], np.ones(len(lights))] @ np.asarray(camera.m_view, dtype=np.float64))[:, :3] # glm arrays are column major: row vectors times the matrix
+            radii = LightClusters.radii(*values[:, 3:].T, LightClusters.CUTOFF)
+            clusters, indices = LightClusters.bin(centers, radii, camera.m_projection, camera.f_near, camera.f_far, self.size)
+            indices = np.array([light.n_index for light in lights], dtype=np.uint16)[indices]
+        else:
+            clusters, indices = np.zeros((*self.size[::-1], 2), dtype=np.uint32), np.zeros(0, dtype=np.uint16)
+        self.index_count = len(indices)
+
+        rows = max(1, -(-len(indices) // LightClusters.INDEX_WIDTH))
+        if rows > self.indices.height: # grown, never shrunk
+            self.indices.release()
+            self.indices = self.ctx.texture((LightClusters.INDEX_WIDTH, rows), 1, dtype="u2")
+            self.indices.filter = (mgl.NEAREST, mgl.NEAREST)
+        padded = np.zeros(rows * LightClusters.INDEX_WIDTH, dtype=np.uint16) # whole rows, only the used ones are written
+        padded[:len(indices)] = indices
+
+        data = (clusters.tobytes(), padded.tobytes())
+        if data != self._uploaded: # static lights and camera: nothing to upload
+            self.clusters.write(data[0])
+            self.indices.write(data[1], viewport=(0, 0, LightClusters.INDEX_WIDTH, rows))
+            self._uploaded = data
+            self.uploads += 1
+        self.clusters.use(TEXTURE.LOCATION.CLUSTERS.value)
+        self.indices.use(TEXTURE.LOCATION.LIGHT_INDICES.value)
+
+    def release(self):
+        self.clusters.release()
+        self.indices.release()
+
+
+if __name__ == "__main__":
+    # benchmark (run from the project root): python -m AGELite.entity.lighting [frames]
+    import sys
+    import time
+
+    from .camera import Camera
+    from ..core.geometry import new_cube
+
+    ctx = mgl.create_standalone_context()
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    size = (640, 360)
+    fbo = ctx.simple_framebuffer(size)
+    blocks = [UniformBlock.create(name, ctx, binding, members) for name, binding, members in (
+        ("frame", UNIFORM_BLOCK.BINDING.FRAME, UNIFORM_BLOCK.FRAME_MEMBERS),
+        ("lights", UNIFORM_BLOCK.BINDING.LIGHTS, UNIFORM_BLOCK.LIGHTS_MEMBERS),
+        ("point_lights", UNIFORM_BLOCK.BINDING.POINT_LIGHTS, UNIFORM_BLOCK.POINT_LIGHTS_MEMBERS))]
+    UniformBlock.get("frame").set("v2_resolution", size)
+
+    camera = Camera(position=glm.vec3(0, 0, 3), rotation=glm.vec2(270, 0), aspect=size[0] / size[1])
+    directional_light = DirectionalLight(rotation=glm.vec3(0, 0, 270))
+    clusters = LightClusters(ctx)
+    vertices, indices = new_cube() # generated: no model file needed
+    vbo, ibo = ctx.buffer(vertices), ctx.buffer(indices)
+
+    # short range lights (about one unit) scattered around the cube
+    rng = np.random.default_rng(0)
+    lights = [PointLight(position=glm.vec3(*rng.uniform(-1.5, 1.5, 3)), color=glm.vec3(*rng.uniform(0.0, 1.0, 3)), constant=1.0, linear=4.0, quadratic=400.0) for _ in range(UNIFORM_BLOCK.MAX_POINT_LIGHTS)]
+
+    for name, defines in (("forward", {}), ("clustered", LightClusters.DEFINES)):
+        program = Program.create(name, ctx, defines=defines)
+        program.write("m_model", glm.mat4())
+        for key, location in TEXTURE.LOCATION_BY_NAME.items(): # samplers of different types can't share a unit (see TEXTURE.enableTexture)
+            if f"map_{key}" in program.program:
+                program.set(f"map_{key}", location.value)
+        if defines:
+            program.set("map_clusters", TEXTURE.LOCATION.CLUSTERS.value)
+            program.set("map_light_indices", TEXTURE.LOCATION.LIGHT_INDICES.value)
+        vertex_array = program.vertex_array(vbo, ibo, indices.itemsize)
+        for count in (0, 10, 50, 100, 200):
+            for i, light in enumerate(lights):
+                (light.enable if i < count else light.disable)("point_lights")
+
+            timings = {"frame": [], "binning": []}
+            for _ in range(frames + 1): # the first frame compiles the variant
+                start = time.perf_counter()
+                camera.update("frame")
+                directional_light.update("lights")
+                for light in lights[:count]:
+                    light.update("point_lights")
+                binning = time.perf_counter()
+                if defines:
+                    clusters.update(camera)
+                timings["binning"].append(time.perf_counter() - binning)
+                for block in blocks:
+                    block.update()
+                fbo.use()
+                fbo.clear(depth=1.0)
+                ctx.enable(mgl.DEPTH_TEST)
+                vertex_array.render()
+                ctx.finish()
+                timings["frame"].append(time.perf_counter() - start)
+            print(f"{name:>9} {count:>3} lights | frame {sum(timings['frame'][1:]) / frames * 1e3:8.2f} ms | binning {sum(timings['binning'][1:]) / frames * 1e3:6.2f} ms | {clusters.index_count / np.prod(LightClusters.SIZE) if defines else count:6.1f} lights per cluster")
@@ -68,5 +68,4 @@ class Skybox(Renderable):
     def update(self, program_name: str):
         self.skybox_texture.use(location=TEXTURE.LOCATION.CUBEMAP.value)
         Program.get(program_name).set("cubemap", TEXTURE.LOCATION.CUBEMAP.value)
-        self.m_view = glm.mat4(glm.mat3(self.camera.m_view))
-        Program.get(program_name).write("m_invProjView", glm.inverse(self.camera.m_projection * self.camera.m_view))
+        self.m_view = glm.mat4(glm.mat3(self.camera.m_view)) # the skybox shader reads m_inv_proj_view from the frame constants (see Camera.update)
@@ -7,6 +7,7 @@ from imgui_bundle import imgui
 
 from ..core.geometry import new_arrow, bake_tangants
 from ..core.program import Program
+from ..core.uniform_block import UniformBlock, UNIFORM_BLOCK
 from ..entity.renderable import Model
 from .objects import UI_Object
 
@@ -40,8 +41,12 @@ class GUI_Arrow(UI_Object):
 
         # mgl elements
         self.blank_program = Program.create("blank", self.ctx, vertex_shader_path=Program.SHADER_FOLDER.joinpath("blank.vert"), fragment_shader_path=Program.SHADER_FOLDER.joinpath("blank.frag"), formats=Program.DEFAULT_FMTS, attrs=Program.DEFAULT_ATTRS)
-        self.vbo = self.ctx.buffer(new_arrow())
-        self.vao = self.ctx.vertex_array(self.blank_program.program, [(self.vbo, self.blank_program.formats, *self.blank_program.attrs)], skip_errors=True)
+        vertices, indices = new_arrow()
+        self.vbo = self.ctx.buffer(vertices)
+        self.ibo = self.ctx.buffer(indices)
+        self.vao = self.blank_program.vertex_array(self.vbo, self.ibo, indices.itemsize)
+        self.frame_constants = UniformBlock.create("arrow", self.ctx, UNIFORM_BLOCK.BINDING.ARROW_FRAME, UNIFORM_BLOCK.FRAME_MEMBERS) # own camera
+        self.blank_program.bind_block("FrameConstants", UNIFORM_BLOCK.BINDING.ARROW_FRAME)
         self.output = self.ctx.texture(size, 4)
         self.depth = self.ctx.depth_texture(size)
         self.fbo = self.ctx.framebuffer(color_attachments=self.output, depth_attachment=self.depth)
@@ -55,13 +60,14 @@ class GUI_Arrow(UI_Object):
 
     def init(self):
         """ Initializes the program """
-        self.blank_program.write("m_proj", glm.perspective(glm.radians(60.0), 1.0, 0.1, 100.0))
-        self.blank_program.write("m_view", glm.lookAt(glm.vec3(0, 0, 8), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0)))
+        self.frame_constants.set("m_proj", glm.perspective(glm.radians(60.0), 1.0, 0.1, 100.0))
+        self.frame_constants.set("m_view", glm.lookAt(glm.vec3(0, 0, 8), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0)))
 
 
     def redraw(self) -> None:   
         """ Redraw the arrow """  
         self.blank_program.write("color", self.color)
+        self.frame_constants.update()
         self.fbo.use()
         self.fbo.clear(color=self.background_color.to_tuple())
         self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE)
@@ -75,6 +81,8 @@ class GUI_Arrow(UI_Object):
         self.output.release()
         self.depth.release()
         self.vbo.release()
+        self.ibo.release()
+        self.frame_constants.release()
 
     def update_from_lc(self, light: 'DirectionalLight', camera: 'Camera') -> None:
         """ Updates the arrow based on the light and the camera """
@@ -84,7 +92,7 @@ class GUI_Arrow(UI_Object):
             self.model.m_model = self.model.get_model_matrix()
 
         camera_m_view = glm.lookAt(glm.normalize(camera.v3_position)*8, camera.v3_position + camera.v3_forward, camera.v3_up)
-        self.blank_program.write("m_view", camera_m_view)
+        self.frame_constants.set("m_view", camera_m_view)
         self.model.update("blank")
         self.redraw()
 
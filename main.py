@@ -26,11 +26,14 @@ class Main(Window):
         self.gui_arrow = GUI_Arrow(self.scene, glm.vec3(0))
         self.ui_tools = UI_ToolsWindow(self.scene)
         self.ui_scene = UI_SceneWindow(self)
+        self.shader_watcher = ShaderWatcher(self.ctx) # reloads the programs when their shader files change
 
         # setting up the windows and componants for imgui
         self.gui.add_window("Settings", UI_Window("Settings"))
         self.gui.add_window_configurable("Settings", self)
         self.gui.add_window_configurable("Settings", UI_Logger)
+        self.gui.add_window_configurable("Settings", TextureRegistry)
+        self.gui.add_window_configurable("Settings", self.shader_watcher)
         self.gui.add_menu_entry("File", "Open settings", lambda: self.gui.toggle_window("Settings"))
 
         self.gui.add_menu("Edit", UI_Menu("Edit"))
@@ -53,13 +56,19 @@ class Main(Window):
         pg.event.set_grab(not self.b_mouse_visible)
 
         # custom default program uniform
-        Program.get("default").set("smooth_normals", self.ui_tools.doSmoothNormals)
+        Program.get("default").set_variant("smooth_normals", self.ui_tools.doSmoothNormals)
+        # compile the variants selected by the tools window ahead of their use, a few per frame (see Program.warm_up_step)
+        textures = sum(TEXTURE.FLAG_BY_NAME[key].value for key in self.ui_tools.textures.keys())
+        cubemap = TEXTURE.FLAG_BY_NAME["cubemap"].value
+        Program.get("default").warm_up([{"enabled_maps": maps} for maps in (0, textures, cubemap, textures | cubemap)], [Program.DEFAULT_FRAGMENT_PATH, Program.PBR_FRAGMENT_PATH])
 
 
     def update(self):
         """ called at each frame before rendering"""
         super().update()   
         self.ui_tools.textures.run_all()
+        self.shader_watcher.update()
+        Program.warm_up_step()
         self.gui_arrow.update_from_lc(self.scene.directional_light, self.scene.camera)
 
     def render(self):
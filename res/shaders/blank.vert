@@ -1,12 +1,12 @@
 #version 330 core
 
+#include "common/frame.glsl"
+
 layout (location = 2) in vec3 in_normal;
 layout (location = 3) in vec3 in_vertex;
 
 out vec3 vn_0;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
 uniform mat4 m_model;
 
 void main()
@@ -0,0 +1,28 @@
+#pragma once
+#include "common/uio.frag"
+// point lights affecting the fragment: every light, or with CLUSTERED_LIGHTS only the lights of its froxel (see LightClusters)
+// usage: ivec2 range = light_range(); for (int i = 0; i < range.y; i++) { PointLight pl = point_lights[light_index(range.x + i)]; ... }
+#ifdef CLUSTERED_LIGHTS
+uniform usampler3D map_clusters;      // (first index, count) of each cluster, CLUSTER_X * CLUSTER_Y tiles * CLUSTER_Z depth slices
+uniform usampler2D map_light_indices; // point light indices of the clusters, CLUSTER_INDEX_WIDTH per row
+
+ivec2 light_range() {
+    float depth = -(m_view * vec4(v3_fragment_position, 1.0)).z;
+    int slice = int(floor(log(depth / f_near) / log(f_far / f_near) * CLUSTER_Z)); // exponential slices, as in LightClusters.bin
+    ivec3 cluster = ivec3(ivec2(gl_FragCoord.xy / v2_resolution * vec2(CLUSTER_X, CLUSTER_Y)), slice);
+    cluster = clamp(cluster, ivec3(0), ivec3(CLUSTER_X, CLUSTER_Y, CLUSTER_Z) - 1);
+    return ivec2(texelFetch(map_clusters, cluster, 0).rg);
+}
+
+int light_index(int i) {
+    return int(texelFetch(map_light_indices, ivec2(i % CLUSTER_INDEX_WIDTH, i / CLUSTER_INDEX_WIDTH), 0).r);
+}
+#else
+ivec2 light_range() {
+    return ivec2(0, point_light_count);
+}
+
+int light_index(int i) {
+    return i;
+}
+#endif
\ No newline at end of file
@@ -1,4 +1,5 @@
-#define MAX_LIGHTS 3
+#pragma once
+#define MAX_POINT_LIGHTS 200 // must match UNIFORM_BLOCK.MAX_POINT_LIGHTS
 
 const float PI = 3.14159265359;
 
@@ -18,14 +19,14 @@ struct DirectionalLight
     Light light;
 };
 
-//struct PointLight
-//{
-//    int enabled;
-//    float constant;
-//    float linear;
-//    float quadratic;
-//    Light light;
-//};
+struct PointLight
+{
+    int enabled;
+    float constant;
+    float linear;
+    float quadratic;
+    Light light;
+};
 
 
 vec3 show_debug_normal(vec3 Kd, vec3 normal) {
@@ -1,3 +1,5 @@
+#pragma once
+const float PI = 3.14159265359;
 
 const mat4 m_shadow_bias = mat4(
     0.5, 0.0, 0.0, 0.0,
@@ -24,4 +26,31 @@ mat3 build_smooth_TBN(vec3 tangent, vec3 bitangent, vec3 normal) {
 
 vec3 get_model_center(mat4 model_matrix) {
     return vec3(model_matrix[3][0], model_matrix[3][1], model_matrix[3][2]);
-}
\ No newline at end of file
+}
+
+// compact vertex format decoding (see pack_compact() in geometry.py)
+vec3 decode_octahedral(vec2 e) {
+    vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+    if (n.z < 0.0) {
+        n.xy = (1.0 - abs(n.yx)) * vec2(n.x >= 0.0 ? 1.0 : -1.0, n.y >= 0.0 ? 1.0 : -1.0);
+    }
+    return normalize(n);
+}
+
+void orthonormal_basis(vec3 n, float s, out vec3 b1, out vec3 b2) {
+    float a = -1.0 / (s + n.z);
+    float b = n.x * n.y * a;
+    b1 = vec3(1.0 + s * n.x * n.x * a, s * b, -s * n.x);
+    b2 = vec3(b, s + n.y * n.y * a, -n.y);
+}
+
+void decode_tbn(vec4 packed_tbn, out vec3 normal, out vec3 tangent, out vec3 bitangent) {
+    vec4 e = clamp(packed_tbn / 32767.0, -1.0, 1.0); // snorm16
+    vec3 b1, b2;
+    normal = decode_octahedral(e.xy);
+    // hemisphere taken from the integer encoding so the basis is the exact same one pack_compact() used, even for n.z ~ 0
+    float s = abs(packed_tbn.x) + abs(packed_tbn.y) > 32767.0 ? -1.0 : 1.0;
+    orthonormal_basis(normal, s, b1, b2);
+    tangent = cos(e.z * PI) * b1 + sin(e.z * PI) * b2;
+    bitangent = sign(e.w) * cross(normal, tangent);
+}
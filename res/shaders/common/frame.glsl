@@ -0,0 +1,12 @@
+#pragma once
+// per frame constants, one buffer shared by every program (see UNIFORM_BLOCK.FRAME_MEMBERS)
+layout (std140) uniform FrameConstants {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_inv_proj_view;
+    vec3 v3_camera_position;
+    float f_time;
+    vec2 v2_resolution;
+    float f_near;
+    float f_far;
+};
\ No newline at end of file
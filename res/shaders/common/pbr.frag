@@ -1,3 +1,6 @@
+#pragma once
+#include "common/uio.frag"
+#include "common/cluster.frag"
 // -------------------------------PBR.FRAG-------------------------------------
 float DistributionGGX(vec3 N, vec3 H, float roughness)
 {
@@ -42,4 +45,32 @@ vec3 fresnelSchlick(float cosTheta, vec3 F0)
 vec3 fresnelSchlickRoughness(float cosTheta, vec3 F0, float roughness)
 {
     return F0 + (max(vec3(1.0 - roughness), F0) - F0) * pow(clamp(1.0 - cosTheta, 0.0, 1.0), 5.0);
+}
+// ----------------------------------------------------------------------------
+vec3 calcPointLights(vec3 N, vec3 V, vec3 F0, vec3 albedo, float metallic, float roughness)
+{
+    vec3 Lo = vec3(0.0);
+
+    ivec2 range = light_range();
+    for (int i = 0; i < range.y; i++)
+    {
+        PointLight pl = point_lights[light_index(range.x + i)];
+        if (pl.enabled != 1) continue;
+
+        vec3 L = normalize(pl.light.position - v3_fragment_position);
+        vec3 H = normalize(V + L);
+        float dist = length(pl.light.position - v3_fragment_position);
+        float attenuation = 1.0 / (pl.constant + pl.linear * dist + pl.quadratic * dist * dist);
+        vec3 radiance = (pl.light.Id + pl.light.Is) * attenuation;
+
+        // Cook-Torrance BRDF
+        float NDF = DistributionGGX(N, H, roughness);
+        float G   = GeometrySmith(N, V, L, roughness);
+        vec3  F   = fresnelSchlick(max(dot(H, V), 0.0), F0);
+        vec3 specular = (NDF * G * F) / (4.0 * max(dot(N, V), 0.0) * max(dot(N, L), 0.0) + 0.0001);
+        vec3 kD = (vec3(1.0) - F) * (1.0 - metallic);
+
+        Lo += (kD * albedo / PI + specular) * radiance * max(dot(N, L), 0.0) + albedo * pl.light.Ia * attenuation;
+    }
+    return Lo;
 }  
\ No newline at end of file
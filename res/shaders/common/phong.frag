@@ -1,3 +1,6 @@
+#pragma once
+#include "common/uio.frag"
+#include "common/cluster.frag"
 //float getSoftShadowX16()
 //{
 //    if (directional_light.shadowable != 1) return 1.0;
@@ -17,36 +20,37 @@
 //    return shadow / 16;
 //}
 
-//vec3 calcPointLight(vec3 Ka, vec3 Kd, vec3 Ks, float Ns, vec3 normal)
-//{
-//    vec3 result = vec3(0.0, 0.0, 0.0);
-//
-//    for (int i = 0; i < MAX_LIGHTS; i++)
-//    {
-//        if (point_lights[i].enabled != 1) continue;
-//        PointLight pl = point_lights[i];
-//
-//        vec3 N = normalize(normal);
-//        vec3 L = normalize(pl.light.position - v3_fragment_position);
-//        vec3 V = normalize(v3_camera_position - v3_fragment_position);
-//        vec3 H = normalize(V + L);
-//
-//        float Ld = max(dot(N, L), 0.0);
-//        float NdotH = max(dot(N, H), 0.0);
-//        
-//        float Ls =  (Ns + 2.0) * pow(NdotH, Ns) / (2.0 * 3.1415);
-//
-//        float dist = length(pl.light.position - v3_fragment_position);
-//        float attenuation = 1.0 / (pl.constant + pl.linear *dist + pl.quadratic *dist*dist);
-//
-//        vec3 ambiant = pl.light.Ia * Ka;
-//        vec3 diffuse = pl.light.Id * Kd * Ld;
-//        vec3 specular = pl.light.Is * Ks * Ls;
-//
-//        result += (ambiant + diffuse + specular) * attenuation;
-//    }
-//    return result;
-//}
+vec3 calcPointLight(vec3 Ka, vec3 Kd, vec3 Ks, float Ns, vec3 normal)
+{
+    vec3 result = vec3(0.0, 0.0, 0.0);
+
+    ivec2 range = light_range();
+    for (int i = 0; i < range.y; i++)
+    {
+        PointLight pl = point_lights[light_index(range.x + i)];
+        if (pl.enabled != 1) continue;
+
+        vec3 N = normalize(normal);
+        vec3 L = normalize(pl.light.position - v3_fragment_position);
+        vec3 V = normalize(v3_camera_position - v3_fragment_position);
+        vec3 H = normalize(V + L);
+
+        float Ld = max(dot(N, L), 0.0);
+        float NdotH = max(dot(N, H), 0.0);
+        
+        float Ls =  (Ns + 2.0) * pow(NdotH, Ns) / (2.0 * 3.1415);
+
+        float dist = length(pl.light.position - v3_fragment_position);
+        float attenuation = 1.0 / (pl.constant + pl.linear *dist + pl.quadratic *dist*dist);
+
+        vec3 ambiant = pl.light.Ia * Ka;
+        vec3 diffuse = pl.light.Id * Kd * Ld;
+        vec3 specular = pl.light.Is * Ks * Ls;
+
+        result += (ambiant + diffuse + specular) * attenuation;
+    }
+    return result;
+}
 
 
 vec3 calcDirectionalLight(vec3 Ka, vec3 Kd, vec3 Ks, float Ns, vec3 normal) {
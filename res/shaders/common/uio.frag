@@ -1,3 +1,6 @@
+#pragma once
+#include "common/common.frag"
+#include "common/frame.glsl"
 // UNIFORMS INPUTS OUTPUTS 
 
 const int CUBEMAP = 1;
@@ -8,6 +11,7 @@ const int ROUGHNESS = 16;
 const int NORMAL = 32;
 const int EMMISIVE = 64;
 const int AO = 128;
+const int ORM = 256; // packed occlusion (r), roughness (g), metallic (b)
 
 
 out vec4 fragment_color;
@@ -27,12 +31,40 @@ uniform sampler2D  map_specular;
 uniform sampler2D  map_normal;
 uniform sampler2D  map_emissive;
 uniform sampler2D  map_ao;
+uniform sampler2D  map_orm;
+
+#ifdef MATERIAL_ARRAY
+// every 2D map is a layer of map_material (see TEXTURE.ARRAY_LAYER_BY_NAME)
+const float LAYER_ALBEDO = 0.0;
+const float LAYER_METALLIC = 1.0;
+const float LAYER_SPECULAR = 2.0;
+const float LAYER_ROUGHNESS = 3.0;
+const float LAYER_NORMAL = 4.0;
+const float LAYER_EMISSIVE = 5.0;
+const float LAYER_AO = 6.0;
+const float LAYER_ORM = 7.0;
+uniform sampler2DArray map_material;
+#define SAMPLE_MAP(map, layer, uv) texture(map_material, vec3(uv, layer))
+#else
+#define SAMPLE_MAP(map, layer, uv) texture(map, uv)
+#endif
 //uniform sampler2DShadow map_shadow;
 
-uniform DirectionalLight directional_light;
-//uniform PointLight[MAX_LIGHTS] point_lights;
+// lights, one buffer shared by every program (see UNIFORM_BLOCK.LIGHTS_MEMBERS)
+layout (std140) uniform Lights {
+    DirectionalLight directional_light;
+};
+// point lights, each PointLight writes its own slot (see UNIFORM_BLOCK.POINT_LIGHTS_MEMBERS)
+layout (std140) uniform PointLights {
+    int point_light_count;
+    PointLight point_lights[MAX_POINT_LIGHTS];
+};
 
+#ifdef ENABLED_MAPS // compiled variant (see Program.set_variant)
+const int enabled_maps = ENABLED_MAPS; // enum_map
+#else
 uniform int enabled_maps; // enum_map
+#endif
 /*uniform bool has_cubemap;
 uniform bool has_albedo;
 uniform bool has_metallic;
@@ -42,6 +74,8 @@ uniform bool has_normal;
 uniform bool has_emissive;
 uniform bool has_ao;*/
 
-uniform vec3 v3_camera_position;
-uniform vec2 v2_resolution;
-uniform bool debug_show_normal;
\ No newline at end of file
+#ifdef DEBUG_SHOW_NORMAL
+const bool debug_show_normal = DEBUG_SHOW_NORMAL != 0;
+#else
+uniform bool debug_show_normal;
+#endif
\ No newline at end of file
@@ -1,9 +1,27 @@
+#pragma once
+#include "common/frame.glsl"
+#ifdef COMPACT_VERTEX
+in vec3 in_vertex;
+in vec4 in_packed_tbn; // snorm16: xy octahedral normal, z tangent angle, w bitangent sign
+in vec2 in_uv;
+
+vec3 in_normal;
+vec3 in_tangent;
+vec3 in_bitangent;
+
+void unpack_attributes() {
+    decode_tbn(in_packed_tbn, in_normal, in_tangent, in_bitangent);
+}
+#else
 in vec3 in_vertex;
 in vec3 in_normal;
 in vec3 in_tangent;
 in vec3 in_bitangent;
 in vec2 in_uv;
 
+void unpack_attributes() {}
+#endif
+
 out vec2 uv_0;
 out vec3 vn_0;
 out vec3 v3_fragment_position;
@@ -11,9 +29,11 @@ out vec4 v3_shadow_position;
 out mat3 TBN;
 out vec3 center;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
 uniform mat4 m_view_light;
 uniform mat4 m_model;
 
-uniform bool smooth_normals;
\ No newline at end of file
+#ifdef SMOOTH_NORMALS // compiled variant (see Program.set_variant)
+const bool smooth_normals = SMOOTH_NORMALS != 0;
+#else
+uniform bool smooth_normals;
+#endif
\ No newline at end of file
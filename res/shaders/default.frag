@@ -15,23 +15,29 @@ void main()
     float metalness = 0.0;
 
     if ((enabled_maps & ALBEDO) != 0) {
-        Ka = texture(map_albedo, uv_0).rgb;
-        Kd = Ka * texture(map_albedo, uv_0).a;
+        Ka = SAMPLE_MAP(map_albedo, LAYER_ALBEDO, uv_0).rgb;
+        Kd = Ka * SAMPLE_MAP(map_albedo, LAYER_ALBEDO, uv_0).a;
     }
     if ((enabled_maps & SPECULAR) != 0) {
-        Ks = texture(map_specular, uv_0).rgb;
+        Ks = SAMPLE_MAP(map_specular, LAYER_SPECULAR, uv_0).rgb;
     }
     if ((enabled_maps & ROUGHNESS) != 0) {
-        Ks = Ks * texture(map_roughness, uv_0).r;
+        Ks = Ks * SAMPLE_MAP(map_roughness, LAYER_ROUGHNESS, uv_0).r;
     }
     if ((enabled_maps & METALLIC) != 0) {
-        metalness = texture(map_metallic, uv_0).r;
+        metalness = SAMPLE_MAP(map_metallic, LAYER_METALLIC, uv_0).r;
     }
     if ((enabled_maps & AO) != 0) {
-        Ka = Ka * texture(map_ao, uv_0).r;
+        Ka = Ka * SAMPLE_MAP(map_ao, LAYER_AO, uv_0).r;
     }        
+    if ((enabled_maps & ORM) != 0) {
+        vec3 orm = SAMPLE_MAP(map_orm, LAYER_ORM, uv_0).rgb;
+        Ka = Ka * orm.r;
+        Ks = Ks * orm.g;
+        metalness = orm.b;
+    }
     if ((enabled_maps & NORMAL) != 0) {
-        normal = texture(map_normal, uv_0).rgb * 2.0 - 1.0;
+        normal = SAMPLE_MAP(map_normal, LAYER_NORMAL, uv_0).rgb * 2.0 - 1.0;
         normal = normalize(TBN * normal);
     }
     if ((enabled_maps & CUBEMAP) != 0) {
@@ -44,7 +50,7 @@ void main()
 
     // lighting
     vec3 color = calcDirectionalLight(Ka, Kd, Ks, Ns, normal);
-    //color += calcPointLight(Ka, Kd, Ks, Ns, normal);
+    color += calcPointLight(Ka, Kd, Ks, Ns, normal);
 
     // debug normals
     if (debug_show_normal) {
@@ -5,6 +5,7 @@
 
 void main()
 {
+    unpack_attributes();
     uv_0 = in_uv;
 
     v3_fragment_position = vec3(m_model * vec4(in_vertex, 1.0));
@@ -14,17 +14,23 @@ void main()
     float ao = 1.0;
 
     if ((enabled_maps & ALBEDO) != 0) {
-        albedo = pow(texture(map_albedo, uv_0).rgb, vec3(2.2));
+        albedo = pow(SAMPLE_MAP(map_albedo, LAYER_ALBEDO, uv_0).rgb, vec3(2.2));
     }
     if ((enabled_maps & METALLIC) != 0) {
-        metallic = texture(map_metallic, uv_0).r;
+        metallic = SAMPLE_MAP(map_metallic, LAYER_METALLIC, uv_0).r;
     }    
     if ((enabled_maps & ROUGHNESS) != 0) {
-        roughness = texture(map_roughness, uv_0).r;
+        roughness = SAMPLE_MAP(map_roughness, LAYER_ROUGHNESS, uv_0).r;
     }
     if ((enabled_maps & AO) != 0) {
-        ao = texture(map_ao, uv_0).r;
+        ao = SAMPLE_MAP(map_ao, LAYER_AO, uv_0).r;
     }    
+    if ((enabled_maps & ORM) != 0) {
+        vec3 orm = SAMPLE_MAP(map_orm, LAYER_ORM, uv_0).rgb;
+        ao = orm.r;
+        roughness = orm.g;
+        metallic = orm.b;
+    }
 
     // input lighting data
     vec3 N = normalize(vn_0);
@@ -32,7 +38,7 @@ void main()
     vec3 R = reflect(-V, N);    
     
     if ((enabled_maps & NORMAL) != 0) {
-        N = texture(map_normal, uv_0).rgb * 2.0 - 1.0;
+        N = SAMPLE_MAP(map_normal, LAYER_NORMAL, uv_0).rgb * 2.0 - 1.0;
         N = normalize(TBN * N);
     }
 
@@ -66,7 +72,7 @@ void main()
     vec3 specular = numerator / denominator;
 
     if ((enabled_maps & SPECULAR) != 0) { 
-        specular *= texture(map_specular, uv_0).r;
+        specular *= SAMPLE_MAP(map_specular, LAYER_SPECULAR, uv_0).r;
     }
 
     // Energy conservation clamping
@@ -87,6 +93,7 @@ void main()
     vec3 ambient = (kD * diffuse) * ao * directional_light.light.Ia;
 
     vec3 color = ambient + (Lo * directional_light.light.Is);
+    color += calcPointLights(N, V, F0, albedo, metallic, roughness);
 
     // gamma correction
     color = color / (color + vec3(1.0));
@@ -1,16 +1,17 @@
 #version 330 core
 
+#include "common/frame.glsl"
+
 layout (location = 0) out vec4 fragColor;
 
 in vec4 clipCoords;
 
 uniform samplerCube cubemap;
-uniform mat4 m_invProjView;
 
 void main()
 {
     // Inversely project from [clip-space] to [normalized world space]
-    vec4 worldCoords = m_invProjView * clipCoords;
+    vec4 worldCoords = m_inv_proj_view * clipCoords;
     vec3 texCubeCoord = normalize(worldCoords.xyz / worldCoords.w);
     
     fragColor = texture(cubemap, texCubeCoord);
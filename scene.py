@@ -11,9 +11,18 @@ if TYPE_CHECKING: from main import Main
 
 class Scene:
     """ Example of a scene """
+    COMPACT_VERTICES = False # use the 24 bytes vertex format (Program.COMPACT_FMTS) instead of the 56 bytes one
+    CLUSTERED_LIGHTS = False # shade only the point lights overlapping the cluster of each fragment (see LightClusters)
+
     def __init__(self, window: 'Main'):
         self.win = window
     
+        ### UNIFORM BLOCKS ###
+        # shared by every program, uploaded once per frame (see UniformBlock)
+        self.frame_constants = UniformBlock.create("frame", self.win.ctx, UNIFORM_BLOCK.BINDING.FRAME, UNIFORM_BLOCK.FRAME_MEMBERS)
+        self.lights = UniformBlock.create("lights", self.win.ctx, UNIFORM_BLOCK.BINDING.LIGHTS, UNIFORM_BLOCK.LIGHTS_MEMBERS)
+        self.point_light_block = UniformBlock.create("point_lights", self.win.ctx, UNIFORM_BLOCK.BINDING.POINT_LIGHTS, UNIFORM_BLOCK.POINT_LIGHTS_MEMBERS)
+
         ### CAMERA ###
         self.camera = Camera(position=glm.vec3(0, 0, 0), rotation=glm.vec2(0, 0), aspect=self.win.f_window_width / self.win.f_window_height)
         self.camera.set_position(self.camera.v3_position - self.camera.v3_forward * 3)
@@ -22,12 +31,27 @@ class Scene:
         ### LIGHTS ###
         self.directional_light = DirectionalLight()
         self.directional_light.rotate(glm.vec3(0, 0, 270))
+        self.point_lights: list[PointLight] = [] # enabled with light.enable("point_lights")
+        self.light_clusters = LightClusters(self.win.ctx) if Scene.CLUSTERED_LIGHTS else None
 
         ### OBJECTS ###
-        self.program = Program.create("default", self.win.ctx) # default shader (will look for a default.vert and default.frag from the shaders folder)
+        defines = dict(TEXTURE.MATERIAL_ARRAY_DEFINES) if TEXTURE.MATERIAL_ARRAY else {} # material maps sampled from one texture array (see MaterialArray)
+        if Scene.CLUSTERED_LIGHTS:
+            defines.update(LightClusters.DEFINES)
+        if Scene.COMPACT_VERTICES:
+            self.program = Program.create("default", self.win.ctx, formats=Program.COMPACT_FMTS, attrs=Program.COMPACT_ATTRS, defines={**Program.COMPACT_DEFINES, **defines})
+        else:
+            self.program = Program.create("default", self.win.ctx, defines=defines) # default shader (will look for a default.vert and default.frag from the shaders folder)
+        if Scene.CLUSTERED_LIGHTS:
+            self.program.set("map_clusters", TEXTURE.LOCATION.CLUSTERS.value)
+            self.program.set("map_light_indices", TEXTURE.LOCATION.LIGHT_INDICES.value)
         self.object = None
         self.cube_vbo = None
+        self.cube_ibo = None
+        self.cube_index_size = 4
         self.sphere_vbo = None
+        self.sphere_ibo = None
+        self.sphere_index_size = 4
         self.object_vao = None
         self.object_kind = ""
 
@@ -36,7 +60,7 @@ class Scene:
         self.skybox = Skybox(self.camera, self.skybox_texture)
         self.skybox_shader = Program.create("skybox", ctx=self.win.ctx, vertex_shader_path=Program.SKYBOX_VERTEX_PATH, fragment_shader_path=Program.SKYBOX_FRAGMENT_PATH, formats=Program.SKYBOX_FMTS, attrs=Program.SKYBOX_ATTRS)
         self.skybox_vbo = self.win.ctx.buffer(new_triangle_screen())
-        self.skybox_vao = self.win.ctx.vertex_array(self.skybox_shader.program, [(self.skybox_vbo, self.skybox_shader.formats, *self.skybox_shader.attrs)], skip_errors=True)
+        self.skybox_vao = self.skybox_shader.vertex_array(self.skybox_vbo)
 
         # set default object
         self.set_sphere()
@@ -49,16 +73,17 @@ class Scene:
             if self.object_vao is not None:
                 self.object_vao.release()
 
-            # creating new vbo if it doesn't exist yet
+            # creating new vbo/ibo if they don't exist yet
             if self.cube_vbo is None:
-                cube_primitive: np.ndarray = new_cube() 
-                vertex_data = cube_primitive.tobytes()
-                self.cube_vbo = self.win.ctx.buffer(vertex_data)
+                cube_vertices, cube_indices = new_cube() 
+                self.cube_vbo = self.win.ctx.buffer(pack_compact(cube_vertices) if Scene.COMPACT_VERTICES else cube_vertices)
+                self.cube_ibo = self.win.ctx.buffer(cube_indices)
+                self.cube_index_size = cube_indices.itemsize
             
             # setting new vao and disabling smooth normals
             self.object_kind = "cube"
-            self.object_vao = self.win.ctx.vertex_array(self.program.program, [(self.cube_vbo, self.program.formats, *self.program.attrs)] , skip_errors=True)
-            self.program.set("smooth_normals", False)
+            self.object_vao = self.program.vertex_array(self.cube_vbo, self.cube_ibo, self.cube_index_size) # rebuilt by Program.swap
+            self.program.set_variant("smooth_normals", False)
 
     def set_sphere(self):
         """ set the sphere object """
@@ -68,31 +93,41 @@ class Scene:
             if self.object_vao is not None:
                 self.object_vao.release()
 
-            # creating new vbo if it doesn't exist yet
+            # creating new vbo/ibo if they don't exist yet
             if self.sphere_vbo is None:
-                sphere_primitive: np.ndarray = new_sphere()
-                vertex_data = sphere_primitive.tobytes()
-                self.sphere_vbo = self.win.ctx.buffer(vertex_data)
+                sphere_vertices, sphere_indices = new_sphere() # memory-mapped from the mesh cache
+                self.sphere_vbo = self.win.ctx.buffer(pack_compact(sphere_vertices) if Scene.COMPACT_VERTICES else sphere_vertices)
+                self.sphere_ibo = self.win.ctx.buffer(sphere_indices)
+                self.sphere_index_size = sphere_indices.itemsize
 
             # setting new vao and enabling smooth normals
             self.object_kind = "sphere"
-            self.object_vao = self.win.ctx.vertex_array(self.program.program, [(self.sphere_vbo, self.program.formats, *self.program.attrs)], skip_errors=True) 
-            self.program.set("smooth_normals", True)
+            self.object_vao = self.program.vertex_array(self.sphere_vbo, self.sphere_ibo, self.sphere_index_size) # rebuilt by Program.swap
+            self.program.set_variant("smooth_normals", True)
         
 
     def init(self):
         """ called at the start of the scene """
-        self.program.set("v2_resolution", self.win.f2_window_size)
+        self.frame_constants.set("v2_resolution", self.win.f2_window_size)
         self.object = Model(position=glm.vec3(0, 0, 0))
 
     def update(self):
         """ called at each frame before rendering"""
-        self.camera.update("default")
-        self.directional_light.update("default")
+        self.camera.update("frame")
+        self.frame_constants.set("f_time", self.win.f_time)
+        self.directional_light.update("lights")
+        for point_light in self.point_lights:
+            point_light.update("point_lights")
+        if self.light_clusters is not None:
+            self.light_clusters.update(self.camera)
         if self.object is not None:
             self.object.update("default")
         self.skybox.update("skybox")
 
+        self.frame_constants.update()
+        self.lights.update()
+        self.point_light_block.update() # only the changed lights are uploaded
+
     def render(self):
         """ called at each frame """
         self.object_vao.render()
@@ -1,16 +1,24 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 if TYPE_CHECKING: from scene import Scene
 from tkinter.filedialog import askopenfilename
+from concurrent.futures import Future
+from functools import partial
 from pathlib import Path
 
 from imgui_bundle import imgui
 
-from AGELite import Texture, TEXTURE
+from AGELite import Texture, TEXTURE, MaterialArray
+from AGELite.core.texture import DecodedImage
 from AGELite.core.deferable import Deferable
+from AGELite.imgui.logging import UI_Logger as Log
 
 
 class TextureSwitcher(Deferable):
     """ Utility class for switching textures dynamically using imgui """
+    PACK_ORM = True # pack the ao/roughness/metallic maps into one "orm" texture (see Texture.decode_orm)
+    ORM_CHANNELS = ("ao", "roughness", "metallic")
+    SINGLE_CHANNEL_KEYS = ("metallic", "roughness", "ao") # uploaded with one component when not packed, shaders only read their red channel
+
     def __init__(self, scene: 'Scene'):
         super().__init__(["disable", "release", "load", "enable"]) # four deferred functions that can't be called during imgui drawing
         # Note: order is important. we disable textures, then release them, then load new ones, then enable them
@@ -18,27 +26,74 @@ class TextureSwitcher(Deferable):
         self.scene = scene
         self.ctx = self.scene.win.ctx
 
-        # self.textures = {typeName: (texture, path), ...}
-        self.textures: dict[str, tuple[Texture, Path]] = {}
+        # self.textures = {typeName: (texture, path), ...} (path is {channel: path, ...} for "orm")
+        self.textures: dict[str, tuple[Texture, Path | dict[str, Path]]] = {}
+
+        # self.loading = {typeName: (decoding future, path), ...} textures being decoded in the background
+        self.loading: dict[str, tuple[Future, Path | dict[str, Path]]] = {}
+
+        # with TEXTURE.MATERIAL_ARRAY the maps are layers of this array (created at the size of the first map), shared by their entries in self.textures
+        self.material: MaterialArray | None = None
 
         """ DEFAULT TEXTURES """
         self.load_texture("albedo"   , Path("res/Textures/Kintsugi/Kintsugi_001_basecolor.png"))
         self.load_texture("normal"   , Path("res/Textures/Kintsugi/Kintsugi_001_normal.png"))
-        self.load_texture("metallic" , Path("res/Textures/Kintsugi/Kintsugi_001_metallic.png"))
-        self.load_texture("roughness", Path("res/Textures/Kintsugi/Kintsugi_001_roughness.png"))
-        self.load_texture("ao"       , Path("res/Textures/Kintsugi/Kintsugi_001_ambientOcclusion.png"))
+        orm = {
+            "ao"       : Path("res/Textures/Kintsugi/Kintsugi_001_ambientOcclusion.png"),
+            "roughness": Path("res/Textures/Kintsugi/Kintsugi_001_roughness.png"),
+            "metallic" : Path("res/Textures/Kintsugi/Kintsugi_001_metallic.png")
+        }
+        if TextureSwitcher.PACK_ORM:
+            self.load_texture("orm", orm)
+        else:
+            [self.load_texture(key, path) for key, path in orm.items()]
 
         # self.enabled: [typeName, ...]
         self.enabled: list[str] = []
     
+    def load_texture(self, key: str, path: Path | dict[str, Path]):
+        """ start decoding a texture in the background, it is uploaded from the "load" queue once decoded 
+        path is a {channel: path} dict of TextureSwitcher.ORM_CHANNELS for a packed texture """
+        # a texture already loaded for this key stays in use until the new one is uploaded
+        mipmaps = TEXTURE.MIPMAP_MODE == TEXTURE.MIPMAPS.CPU
+        if isinstance(path, dict):
+            source = partial(Texture.decode_orm, *(path.get(channel) for channel in TextureSwitcher.ORM_CHANNELS), mipmaps=mipmaps)
+        else:
+            source = partial(Texture.decode, path, mipmaps=mipmaps, components=1 if key in TextureSwitcher.SINGLE_CHANNEL_KEYS else 4)
+        future = Texture.submit(source)
+        self.loading[key] = (future, path) # the last requested path wins
+        self._upload_texture(key, future, source)
+
     # defered functions that will be called after imgui drawing
     @Deferable.defer("load")
-    def load_texture(self, key: str, path: Path):
-        if key in self.textures: raise ValueError(f"key {key} already in self.textures. Please release it first.")
-        self.textures[key] = (Texture.from_file(self.ctx, path), path)
+    def _upload_texture(self, key: str, future: Future, source: Callable[[], DecodedImage]):
+        if not future.done(): return Deferable.PENDING
+        if key not in self.loading or self.loading[key][0] is not future: return # replaced or released while decoding
+        _, path = self.loading.pop(key)
+
+        try:
+            decoded = future.result()
+        except Exception as e:
+            Log.print(f"Can't load texture '{path}': {e}")
+            return
+
+        if TEXTURE.MATERIAL_ARRAY and key in TEXTURE.ARRAY_LAYER_BY_NAME:
+            if self.material is None:
+                self.material = MaterialArray(self.ctx, decoded[0])
+            self.material.set_layer(key, decoded) # overwrites the previous map in place
+            texture = self.material
+        else:
+            if key in self.textures:
+                self.textures[key][0].release()
+            texture = Texture.from_decoded(self.ctx, decoded, source=source) # reloaded from source if evicted
+        self.textures[key] = (texture, path)
+
+        if key in self.enabled: # rebind the new texture
+            TEXTURE.enableTexture(self.scene, key, self.textures[key][0])
 
     @Deferable.defer("enable")
     def enable_texture(self, key: str):
+        if key not in self.textures and key in self.loading: return Deferable.PENDING # enabled once uploaded
         if key not in self.textures or key in self.enabled: return        
         TEXTURE.enableTexture(self.scene, key, self.textures[key][0])
         self.enabled.append(key)
@@ -48,11 +103,25 @@ class TextureSwitcher(Deferable):
         if key not in self.textures or key not in self.enabled: return
         self._disable_texture(key)
 
-    @Deferable.defer("release")
     def release_texture(self, key: str):
+        """ release a texture from the "release" queue, the upload pending now is dropped (not one requested after this call) """
+        pending = self.loading[key][0] if key in self.loading else None
+        self._release_texture(key, pending)
+
+    @Deferable.defer("release")
+    def _release_texture(self, key: str, pending: Future | None):
+        if pending is not None and key in self.loading and self.loading[key][0] is pending: # still the upload pending when the release was asked
+            del self.loading[key]
         if key not in self.textures: return
         self._disable_texture(key)
-        self.textures[key][0].texture.release()
+        texture = self.textures.pop(key)[0]
+        if texture is not self.material:
+            texture.release()
+            return
+        self.material.clear_layer(key)
+        if not self.material.layers: # last map of the array
+            self.material.release()
+            self.material = None
 
     # non-defered version of the disable texture for usage in defered functions
     def _disable_texture(self, key: str):
@@ -60,10 +129,11 @@ class TextureSwitcher(Deferable):
         TEXTURE.disableTexture(self.scene, key)
         self.enabled.remove(key)
 
-    # batch functions
-    def enable_all(self):  [self.enable_texture(key)  for key in self.textures.keys()]
-    def disable_all(self): [self.disable_texture(key) for key in self.textures.keys()]
-    def release_all(self): [self.release_texture(key) for key in self.textures.keys()]
+    # batch functions (textures still decoding are included)
+    def keys(self) -> list[str]: return list(self.textures.keys() | self.loading.keys())
+    def enable_all(self):  [self.enable_texture(key)  for key in self.keys()]
+    def disable_all(self): [self.disable_texture(key) for key in self.keys()]
+    def release_all(self): [self.release_texture(key) for key in self.keys()]
 
     def ui(self): 
         # imgui drawings
@@ -75,21 +145,36 @@ class TextureSwitcher(Deferable):
                 if val: self.enable_texture(key)
                 else:   self.disable_texture(key)
 
-            imgui.same_line()
-            if imgui.button(f"#{key}"):
-
-                _new_path_result = askopenfilename(title = "Select file") # tkinter.filedialog.askopenfilename
-                if _new_path_result is not None:
-                    new_path = Path(_new_path_result)
-                    if new_path is not None and new_path.exists() and new_path.is_file() and new_path.suffix in (".png", ".jpg", ".jpeg", ".bmp"):
-                        if key in self.enabled:
-                            self.release_texture(key)
-                            self.enable_texture(key)
-                        self.load_texture(key, new_path)
-            
-            imgui.set_item_tooltip("Path: " + str(value[1]))
+            if isinstance(value[1], dict): # packed texture: one file per channel
+                for channel in TextureSwitcher.ORM_CHANNELS:
+                    imgui.same_line()
+                    if imgui.button(f"#{channel}") and (new_path := TextureSwitcher._ask_texture_path()) is not None:
+                        self.load_texture(key, {**value[1], channel: new_path}) # repacked in the background
+                    imgui.set_item_tooltip("Path: " + str(value[1].get(channel)))
+            else:
+                imgui.same_line()
+                if imgui.button(f"#{key}") and (new_path := TextureSwitcher._ask_texture_path()) is not None:
+                    self.load_texture(key, new_path) # decoded in the background, swapped in place once uploaded
+                imgui.set_item_tooltip("Path: " + str(value[1]))
+            if key in self.loading:
+                imgui.same_line()
+                imgui.text_disabled("loading...")
+
+        for key in self.loading.keys() - self.textures.keys():
+            imgui.text_disabled(f"{key} (loading...)")
 
         imgui.end_group()
 
+    @staticmethod
+    def _ask_texture_path() -> Path | None:
+        """ open a file dialog to select an image, None if cancelled or not an image """
+        _new_path_result = askopenfilename(title = "Select file") # tkinter.filedialog.askopenfilename
+        if not _new_path_result:
+            return None
+        new_path = Path(_new_path_result)
+        if new_path.exists() and new_path.is_file() and new_path.suffix in (".png", ".jpg", ".jpeg", ".bmp"):
+            return new_path
+        return None
+
             
 
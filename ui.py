@@ -80,10 +80,10 @@ class UI_ToolsWindow:
             else:                self.scene.program.swap(Program.DEFAULT_VERTEX_PATH, Program.DEFAULT_FRAGMENT_PATH)
 
         if b_toggle_normals:
-            Program.get("default").set("debug_show_normal", self.doToggleNormals)
+            Program.get("default").set_variant("debug_show_normal", self.doToggleNormals)
 
         if b_smooth_normals:
-            self.scene.program.set("smooth_normals", self.doSmoothNormals)
+            self.scene.program.set_variant("smooth_normals", self.doSmoothNormals)
 
         if b_toggle_camera_mode:
             self.scene.camera.camera_mode = self._camera_modes[self.cameraMode]